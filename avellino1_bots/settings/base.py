@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,13 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'coca_bot.webhook.SecretTokenMiddleware',
+]
+
+# Chain run by the Telegram webhooks, dispatched in wsgi.py: none of sessions, auth, messages,
+# CSRF or clickjacking is used by the bot, the secret token header replaces CSRF
+WEBHOOK_MIDDLEWARE = [
+    'coca_bot.webhook.SecretTokenMiddleware',
 ]
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -83,6 +91,13 @@ DATABASES = {
     }
 }
 
+# Reads made while handling an update go to DATABASES['replica'] when it is configured
+DATABASE_ROUTERS = ['coca_bot.routers.ReplicaRouter']
+
+# Persistent connections (CONN_MAX_AGE) are pinged before a request at most this often,
+# and reopened when the server dropped them. -1 disables the check
+DB_HEALTH_CHECK_SECONDS = int(os.getenv("DB_HEALTH_CHECK_SECONDS", 30))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -119,10 +134,42 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Group served by /webhooks/av1cocabot/ and by commands run without --gruppo
+DEFAULT_GRUPPO = os.getenv("DEFAULT_GRUPPO", "av1cocabot")
+GRUPPI_CACHE_SECONDS = int(os.getenv("GRUPPI_CACHE_SECONDS", 60))
+
+TELEGRAM_URL = "https://api.telegram.org/bot"
+TUTORIAL_BOT_TOKEN = os.getenv("TUTORIAL_BOT_TOKEN", "error_token")
+# Members per page of /api/<slug>/iscritti/ when the client sends no limit, and the most it may ask for
+API_LIMITE = int(os.getenv("API_LIMITE", 100))
+API_LIMITE_MAX = int(os.getenv("API_LIMITE_MAX", 1000))
+# Default secret_token of the webhooks, registered by imposta_webhook. Without one every update
+# is rejected, except with DEBUG on
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+# Bot API calls give up after these seconds, and stop for TELEGRAM_BREAKER_RESET_SECONDS
+# after TELEGRAM_BREAKER_FAILURES failures in a row
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", 3.05))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", 10))
+TELEGRAM_BREAKER_FAILURES = int(os.getenv("TELEGRAM_BREAKER_FAILURES", 5))
+TELEGRAM_BREAKER_RESET_SECONDS = int(os.getenv("TELEGRAM_BREAKER_RESET_SECONDS", 30))
+# Undelivered messages older than this are no longer worth sending
+NON_CONSEGNATI_MAX_ORE = int(os.getenv("NON_CONSEGNATI_MAX_ORE", 24))
+TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME", "AV1CoCaBot")
+# The first reply of an update travels in the webhook response when it is the only one
+WEBHOOK_REPLY_INLINE = os.getenv("WEBHOOK_REPLY_INLINE", "True") == "True"
+
 SHAREPOINT_URL = os.getenv("SHAREPOINT_URL", "error_token")
 SHAREPOINT_USERNAME = os.getenv("SHAREPOINT_USERNAME", "error_token")
 SHAREPOINT_PASSWORD = os.getenv("SHAREPOINT_PASSWORD", "error_token")
+# One or more workbooks, comma separated
 DOCUMENTS_URL = os.getenv("DOCUMENTS_URL", "error_token")
+# Worker processes parsing the workbooks in load_excel and runscheduler when there is more than one,
+# /aggiorna parses them in the web worker
+DATALOADER_PROCESSES = int(os.getenv("DATALOADER_PROCESSES", 2))
+# Workbooks are downloaded in memory up to DATALOADER_SPOOL_BYTES, then in a temporary file,
+# and a sync stops when one is larger than DATALOADER_MAX_BYTES
+DATALOADER_SPOOL_BYTES = int(os.getenv("DATALOADER_SPOOL_BYTES", 10 * 1024 * 1024))
+DATALOADER_MAX_BYTES = int(os.getenv("DATALOADER_MAX_BYTES", 50 * 1024 * 1024))
 
 EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
 EMAIL_HOST = os.getenv("EMAIL_HOST", "error_token")
@@ -131,5 +178,75 @@ EMAIL_PORT = int(os.getenv("EMAIL_PORT", 25))
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "avellino1@campania.agesci.it")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "error_token")
 EMAIL_FROM = os.getenv("EMAIL_FROM", "avellino1@campania.agesci.it")
+MAIL_QUEUE_RETRIES = int(os.getenv("MAIL_QUEUE_RETRIES", 3))
+MAIL_QUEUE_RETRY_DELAY = float(os.getenv("MAIL_QUEUE_RETRY_DELAY", 5))
+
+# Telegram allows about 30 messages per second to different chats
+ANNUNCI_MESSAGES_PER_SECOND = float(os.getenv("ANNUNCI_MESSAGES_PER_SECOND", 25))
+# Announcements not checkpointed for this long are resumed by invia_annunci and the resume job of runscheduler
+ANNUNCI_LEASE_SECONDS = int(os.getenv("ANNUNCI_LEASE_SECONDS", 120))
+
+# Rows fetched per round trip when commands stream large result sets
+QUERY_CHUNK_SIZE = int(os.getenv("QUERY_CHUNK_SIZE", 500))
+
+# /info, /codicesocio and the role checks read the members from an in-process snapshot,
+# whose version is checked against the database at most this often
+ISCRITTI_SNAPSHOT = os.getenv("ISCRITTI_SNAPSHOT", "True") == "True"
+ISCRITTI_SNAPSHOT_SECONDS = int(os.getenv("ISCRITTI_SNAPSHOT_SECONDS", 5))
+
+# Replies of /info and /codicesocio cached per process, at most this many searches for this long
+RISULTATI_CACHE_MAX = int(os.getenv("RISULTATI_CACHE_MAX", 256))
+RISULTATI_CACHE_SECONDS = int(os.getenv("RISULTATI_CACHE_SECONDS", 120))
+
+# Token buckets of the users: role -> [capacity, tokens refilled per second], as JSON in the environment
+THROTTLE_ATTIVO = os.getenv("THROTTLE_ATTIVO", "True") == "True"
+THROTTLE_LIMITI = json.loads(os.getenv(
+    "THROTTLE_LIMITI", '{"SA": [100, 2], "AD": [60, 1], "CA": [30, 0.5], "IS": [10, 0.2]}'
+))
+# Tokens taken by each command, the second value when it lists the whole register (no argument or "tutti")
+THROTTLE_COSTI = {
+    'start': 0,
+    'help': 0,
+    'info': (2, 20),
+    'socio': (2, 20),
+    'codicesocio': (1, 10),
+    'codice': (1, 10),
+    'generacodice': (5, 20),
+    'inviacodice': (2, 20),
+    'abilitati': 5,
+    'aggiorna': 30,
+    'annuncio': 20,
+    'getlog': 3,
+}
+
+# Share of updates and syncs traced, 0 turns tracing off
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", 0))
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join(BASE_DIR, 'traces.jsonl'))
+TRACING_FILE_MAX_BYTES = int(os.getenv("TRACING_FILE_MAX_BYTES", 10 * 1024 * 1024))
+TRACING_FILE_BACKUPS = int(os.getenv("TRACING_FILE_BACKUPS", 5))
+# OTLP/HTTP traces endpoint of a collector, e.g. http://localhost:4318/v1/traces, replaces the file when set
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "")
+
+# Commands profiled from the environment, e.g. "info:3,load_excel" profiles the next 3 /info and one load_excel
+PROFILA_COMANDI = os.getenv("PROFILA_COMANDI", "")
+PROFILA_INTERVALLO_MS = float(os.getenv("PROFILA_INTERVALLO_MS", 5))
+# How often the commands armed with /profila are read again from the database
+PROFILA_CACHE_SECONDS = int(os.getenv("PROFILA_CACHE_SECONDS", 10))
+
+# runscheduler: how often each job runs, 0 turns a job off
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", 30))
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", 600))
+SCHEDULER_SYNC_SECONDS = int(os.getenv("SCHEDULER_SYNC_SECONDS", 6 * 60 * 60))
+SCHEDULER_RETENTION_SECONDS = int(os.getenv("SCHEDULER_RETENTION_SECONDS", 24 * 60 * 60))
+SCHEDULER_STATISTICHE_SECONDS = int(os.getenv("SCHEDULER_STATISTICHE_SECONDS", 24 * 60 * 60))
+SCHEDULER_REPLAY_SECONDS = int(os.getenv("SCHEDULER_REPLAY_SECONDS", 5 * 60))
+SCHEDULER_RESUME_SECONDS = int(os.getenv("SCHEDULER_RESUME_SECONDS", 2 * 60))
+# AppLogs older than this are deleted by the retention job
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 7))
+
+# Values offered by the admin filters on the log table are recomputed this often
+ADMIN_FILTRI_CACHE_SECONDS = int(os.getenv("ADMIN_FILTRI_CACHE_SECONDS", 600))
+# Admin change lists count at most this many rows, past it the total of a whole table is estimated
+ADMIN_CONTEGGIO_MAX = int(os.getenv("ADMIN_CONTEGGIO_MAX", 10000))
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
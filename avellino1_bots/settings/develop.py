@@ -1,3 +1,13 @@
 from avellino1_bots.settings.base import *
 
-ALLOWED_HOSTS = ["*"]
\ No newline at end of file
+ALLOWED_HOSTS = ["*"]
+
+if os.getenv("USE_REPLICA", "False") == "True":
+    # Second SQLite file standing in for the read replica, copy db.sqlite3 over it to sync
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
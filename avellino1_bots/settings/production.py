@@ -15,9 +15,22 @@ DATABASES = {
         'PASSWORD': os.getenv("DATABASE_PASSWORD", "error_token"),
         'HOST': os.getenv("DATABASE_HOST", "error_token"),
         'PORT': os.getenv("DATABASE_PORT", "error_token"),
+        # Streaming listings rely on server-side cursors, disable them only behind a transaction pooler
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv("DISABLE_SERVER_SIDE_CURSORS", "False") == "True",
+        # Seconds a connection is reused across requests, 0 closes it after each one
+        'CONN_MAX_AGE': int(os.getenv("CONN_MAX_AGE", 600)),
     }
 }
 
+if os.getenv("DATABASE_REPLICA_HOST"):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv("DATABASE_REPLICA_HOST"),
+        'PORT': os.getenv("DATABASE_REPLICA_PORT", DATABASES['default']['PORT']),
+        'USER': os.getenv("DATABASE_REPLICA_USER", DATABASES['default']['USER']),
+        'PASSWORD': os.getenv("DATABASE_REPLICA_PASSWORD", DATABASES['default']['PASSWORD']),
+    }
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Static files (CSS, JavaScript, Images)
@@ -16,7 +16,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from coca_bot.api import IscrittiApiView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('webhooks/av1cocabot/', include('coca_bot.urls'))
+    path('webhooks/<slug:gruppo>/', include('coca_bot.urls')),
+    path('api/<slug:gruppo>/iscritti/', IscrittiApiView.as_view()),
 ]
@@ -13,4 +13,16 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avellino1_bots.settings')
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+# Imported once get_wsgi_application has loaded the apps
+from coca_bot.webhook import WebhookHandler  # noqa: E402
+
+webhook_application = WebhookHandler()
+
+
+def application(environ, start_response):
+    # Telegram updates only go through WEBHOOK_MIDDLEWARE
+    if environ.get('PATH_INFO', '').startswith('/webhooks/'):
+        return webhook_application(environ, start_response)
+    return django_application(environ, start_response)
@@ -1,20 +1,139 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 # Register your models here.
-from coca_bot.models import Iscritti, AppLogs
+from coca_bot.models import Iscritti, AppLogs, Gruppi, Esecuzioni, MessaggiNonConsegnati, ChiaviApi
+
+
+def valori_filtro(model, campo: str) -> list:
+    """Distinct values of a column offered by a list filter, kept in the cache for ADMIN_FILTRI_CACHE_SECONDS."""
+    chiave = f'admin_filtro_{model._meta.label_lower}_{campo}'
+    valori = cache.get(chiave)
+    if valori is None:
+        valori = list(model.objects.order_by(campo).values_list(campo, flat=True).distinct())
+        cache.set(chiave, valori, settings.ADMIN_FILTRI_CACHE_SECONDS)
+    return valori
+
+
+class PaginatorConteggioLimitato(Paginator):
+    """Counts at most ADMIN_CONTEGGIO_MAX rows instead of running COUNT(*) over the whole table on every page.
+
+    Past the limit an unfiltered list on PostgreSQL shows the planner estimate of the table size,
+    a filtered one shows the limit.
+    """
+
+    @cached_property
+    def count(self):
+        limite = settings.ADMIN_CONTEGGIO_MAX
+        conteggio = self.object_list[:limite + 1].count()
+        if conteggio <= limite:
+            return conteggio
+        if not self.object_list.query.where and connections[self.object_list.db].vendor == 'postgresql':
+            with connections[self.object_list.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [self.object_list.model._meta.db_table]
+                )
+                riga = cursor.fetchone()
+            if riga is not None:
+                return max(riga[0], limite)
+        return limite
+
+
+class FiltroValoriCache(admin.SimpleListFilter):
+    """List filter whose values come from the cache instead of a DISTINCT over the whole table on every page."""
+    campo = None
+
+    def lookups(self, request, model_admin):
+        return [(valore, valore) for valore in valori_filtro(model_admin.model, self.campo)]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(**{self.campo: self.value()})
+
+
+class FiltroUsername(FiltroValoriCache):
+    title = 'username'
+    parameter_name = campo = 'username'
+
+
+class FiltroCommand(FiltroValoriCache):
+    title = 'command'
+    parameter_name = campo = 'command'
+
+
+class GruppiAdmin(admin.ModelAdmin):
+    list_display = ('slug', 'nome', 'bot_username', 'active')
+    search_fields = ('slug', 'nome')
 
 
 class IscrittiAdmin(admin.ModelAdmin):
-    list_display = ('codice_socio', 'nome', 'cognome', 'codice_fiscale', 'branca', 'telegram')
+    list_display = ('codice_socio', 'nome', 'cognome', 'codice_fiscale', 'branca', 'telegram', 'gruppo')
     # list_filter = ('codice_socio', 'nome', 'cognome', 'codice_fiscale', 'branca')
+    list_filter = ('gruppo',)
+    list_select_related = ('gruppo',)
     sortable_by = ('codice_socio', 'nome', 'cognome', 'codice_fiscale', 'branca')
-    search_fields = ('codice_socio', 'nome', 'cognome', 'codice_fiscale', 'branca')
+    # Exact and prefix lookups, served by the indexes of migration 0008
+    search_fields = ('=codice_socio', '=codice_fiscale', '^cognome', '^nome')
+    show_full_result_count = False
+    paginator = PaginatorConteggioLimitato
 
 class AppLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'command', 'log_time')
-    list_filter = ('username', 'command')
+    list_display = ('id', 'username', 'command', 'log_time', 'gruppo')
+    list_filter = ('gruppo', FiltroUsername, FiltroCommand)
+    list_select_related = ('gruppo',)
     sortable_by = ('id', 'username', 'command', 'log_time')
-    search_fields = ('username', 'command', 'log_time')
+    search_fields = ('=username', '^command')
+    date_hierarchy = 'log_time'
+    show_full_result_count = False
+    paginator = PaginatorConteggioLimitato
+
+class EsecuzioniAdmin(admin.ModelAdmin):
+    list_display = ('job', 'inizio', 'durata_ms', 'esito', 'proprietario')
+    list_filter = ('job', 'esito')
+    date_hierarchy = 'inizio'
+    show_full_result_count = False
+    paginator = PaginatorConteggioLimitato
+
+class MessaggiNonConsegnatiAdmin(admin.ModelAdmin):
+    list_display = ('id', 'gruppo', 'creato', 'metodo', 'stato', 'tentativi', 'errore')
+    list_filter = ('stato', 'gruppo')
+    list_select_related = ('gruppo',)
+    show_full_result_count = False
+    paginator = PaginatorConteggioLimitato
+
+class ChiaviApiAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'gruppo', 'campi', 'active')
+    list_filter = ('gruppo', 'active')
+    list_select_related = ('gruppo',)
+    actions = ['rigenera']
+
+    def save_model(self, request, obj, form, change):
+        chiave = None if change else obj.genera()
+        super().save_model(request, obj, form, change)
+        if chiave is not None:
+            self.mostra_chiave(request, obj, chiave)
+
+    def rigenera(self, request, queryset):
+        for obj in queryset:
+            chiave = obj.genera()
+            obj.save(update_fields=['impronta'])
+            self.mostra_chiave(request, obj, chiave)
+    rigenera.short_description = 'Rigenera le chiavi selezionate'
+
+    def mostra_chiave(self, request, obj, chiave: str):
+        # Only the hash is saved, this is the one time the key can be read
+        self.message_user(request, f'Chiave di {obj.nome}: {chiave} (copiala ora, non verrà più mostrata)',
+                          messages.WARNING)
 
+admin.site.register(Gruppi, GruppiAdmin)
 admin.site.register(Iscritti, IscrittiAdmin)
-admin.site.register(AppLogs, AppLogAdmin)
\ No newline at end of file
+admin.site.register(AppLogs, AppLogAdmin)
+admin.site.register(Esecuzioni, EsecuzioniAdmin)
+admin.site.register(MessaggiNonConsegnati, MessaggiNonConsegnatiAdmin)
+admin.site.register(ChiaviApi, ChiaviApiAdmin)
@@ -0,0 +1,93 @@
+import base64
+import hashlib
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.gzip import gzip_page
+
+from coca_bot.gruppi import get_gruppo
+from coca_bot.models import ChiaviApi, Gruppi, Iscritti
+
+# Fields other tools may read, the Telegram auth code stays in the bot
+API_CAMPI = ('id', 'codice_socio', 'codice_fiscale', 'nome', 'cognome', 'sesso', 'data_di_nascita', 'comune_di_nascita',
+             'indirizzo', 'civico', 'comune', 'provincia', 'cap', 'informativa2a', 'informativa2b', 'consenso_immagini',
+             'livello_foca', 'coca', 'branca', 'cellulare', 'email', 'telegram', 'telegram_id', 'active', 'role')
+
+
+def codifica_cursore(ultimo_id: int) -> str:
+    return base64.urlsafe_b64encode(str(ultimo_id).encode()).decode().rstrip('=')
+
+
+def decodifica_cursore(cursore: str) -> int:
+    """Id after which the page starts, ValueError when the cursor was not made by codifica_cursore."""
+    return int(base64.urlsafe_b64decode(cursore + '=' * (-len(cursore) % 4)).decode())
+
+
+def errore(status: int, messaggio: str) -> JsonResponse:
+    return JsonResponse({'errore': messaggio}, status=status)
+
+
+@method_decorator(gzip_page, name='dispatch')
+class IscrittiApiView(View):
+    """Read-only listing of the members of a group for the other group tools.
+
+    Pages follow the member id: ``next`` is the cursor of the following page, null on the
+    last one. The ETag changes with versione_iscritti, so polling clients sending
+    If-None-Match get a 304 until the next sync or edit.
+    """
+
+    def get(self, request, *args, **kwargs):
+        gruppo = get_gruppo(kwargs['gruppo'])
+        if gruppo is None:
+            return errore(404, 'Gruppo sconosciuto')
+        chiave = self.autentica(request, gruppo)
+        if chiave is None:
+            response = errore(401, 'Chiave API mancante o non valida')
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+
+        consentiti = [campo.strip() for campo in chiave.campi.split(',') if campo.strip()] or list(API_CAMPI)
+        richiesti = request.GET.get('fields')
+        campi = [campo.strip() for campo in richiesti.split(',') if campo.strip()] if richiesti else consentiti
+        non_consentiti = [campo for campo in campi if campo not in consentiti or campo not in API_CAMPI]
+        if non_consentiti:
+            return errore(400, f'Campi non disponibili: {", ".join(non_consentiti)}')
+        try:
+            limite = min(int(request.GET.get('limit', settings.API_LIMITE)), settings.API_LIMITE_MAX)
+            dopo = decodifica_cursore(request.GET['cursor']) if request.GET.get('cursor') else 0
+        except ValueError:
+            return errore(400, 'Parametri limit o cursor non validi')
+        if limite < 1:
+            return errore(400, 'Parametri limit o cursor non validi')
+
+        # Not the cached group, its version can be GRUPPI_CACHE_SECONDS old
+        versione = Gruppi.objects.filter(id=gruppo.id).values_list(
+            'versione_iscritti', flat=True
+        ).first()
+        pagina = hashlib.sha1(f'{",".join(campi)}|{limite}|{dopo}'.encode()).hexdigest()[:12]
+        etag = f'"{gruppo.slug}-{versione}-{pagina}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            righe = list(
+                Iscritti.objects.filter(gruppo=gruppo, id__gt=dopo)
+                .order_by('id').values('id', *campi)[:limite + 1]
+            )
+            successivo = codifica_cursore(righe[limite - 1]['id']) if len(righe) > limite else None
+            risultati = [{campo: riga[campo] for campo in campi} for riga in righe[:limite]]
+            response = JsonResponse({'versione': versione, 'results': risultati, 'next': successivo})
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def autentica(self, request, gruppo: Gruppi):
+        schema, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if schema.lower() != 'bearer' or not token:
+            return None
+        # Looked up by hash, the keys are not stored
+        return ChiaviApi.objects.filter(
+            gruppo=gruppo, impronta=ChiaviApi.impronta_di(token.strip()), active=True
+        ).first()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CocaBotConfig(AppConfig):
     name = 'coca_bot'
+
+    def ready(self):
+        # Connect the signal receivers that keep the process-wide caches fresh and check the connections
+        from coca_bot import connessioni, gruppi, profili, snapshot  # noqa: F401
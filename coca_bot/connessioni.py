@@ -0,0 +1,65 @@
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.dispatch import receiver
+
+from coca_bot.gruppi import attiva_gruppo, get_gruppo, ripristina_gruppo
+from coca_bot.limiti import ruolo_utente
+from coca_bot.models import AppLogs, Gettoni, Gruppi
+from coca_bot.profili import profilazione_per
+from coca_bot.routers import fine_update, inizia_update
+
+# Connections are per thread, so are the times they were last checked
+_verifiche = threading.local()
+
+
+@receiver(request_started)
+def verifica_connessioni(**kwargs):
+    """Closes the persistent connections the server dropped meanwhile, so the request opens new ones.
+
+    Each connection is pinged at most every DB_HEALTH_CHECK_SECONDS, -1 turns the check off.
+    """
+    if settings.DB_HEALTH_CHECK_SECONDS < 0:
+        return
+    verificate = getattr(_verifiche, 'alias', None)
+    if verificate is None:
+        verificate = _verifiche.alias = {}
+    adesso = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if adesso - verificate.get(connection.alias, 0) < settings.DB_HEALTH_CHECK_SECONDS:
+            continue
+        verificate[connection.alias] = adesso
+        if not connection.is_usable():
+            connection.close()
+
+
+def preriscalda_worker():
+    """Opens the connections and runs the lookups of an update once, before the worker takes the first one.
+
+    The groups, the member snapshots and the /profila armings land in the caches of this
+    process, the database sessions load the catalog of the tables every update touches.
+    """
+    try:
+        for connection in connections.all():
+            connection.ensure_connection()
+        for gruppo in Gruppi.objects.filter(active=True):
+            gruppo = get_gruppo(gruppo.slug)
+            token = attiva_gruppo(gruppo)
+            update_token = inizia_update()
+            try:
+                ruolo_utente('')
+                profilazione_per('', gruppo)
+                Gettoni.objects.filter(gruppo=gruppo, utente='').exists()
+                AppLogs.objects.filter(gruppo=gruppo, update_id=0).exists()
+            finally:
+                fine_update(update_token)
+                ripristina_gruppo(token)
+    except Exception:
+        # A cold worker still serves updates
+        traceback.print_exc()
@@ -0,0 +1,47 @@
+import contextvars
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from coca_bot.models import Gruppi
+
+# Group of the update being handled, copied into the callbacks run by background queues
+_gruppo_corrente = contextvars.ContextVar('gruppo_corrente', default=None)
+
+# Shared by every request of the process: slug -> (loaded at, Gruppi)
+_gruppi = {}
+
+
+def get_gruppo(slug: str):
+    """Returns the active group with the given slug, or None."""
+    cached = _gruppi.get(slug)
+    if cached is not None and time.monotonic() - cached[0] < settings.GRUPPI_CACHE_SECONDS:
+        return cached[1]
+    gruppo = Gruppi.objects.filter(slug=slug, active=True).first()
+    _gruppi[slug] = (time.monotonic(), gruppo)
+    return gruppo
+
+
+def attiva_gruppo(gruppo: Gruppi):
+    """Makes gruppo the current group, returns the token to pass to ripristina_gruppo."""
+    return _gruppo_corrente.set(gruppo)
+
+
+def ripristina_gruppo(token):
+    _gruppo_corrente.reset(token)
+
+
+def gruppo_corrente() -> Gruppi:
+    gruppo = _gruppo_corrente.get()
+    if gruppo is None:
+        # Management commands and single-group deployments
+        gruppo = get_gruppo(settings.DEFAULT_GRUPPO)
+    return gruppo
+
+
+@receiver(post_save, sender=Gruppi)
+@receiver(post_delete, sender=Gruppi)
+def invalida_gruppi(sender, **kwargs):
+    _gruppi.clear()
@@ -0,0 +1,60 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from coca_bot.gruppi import gruppo_corrente
+from coca_bot.models import Gettoni, Gruppi, Iscritti
+from coca_bot.snapshot import snapshot_iscritti
+
+
+def costo_comando(s: list) -> int:
+    """Tokens taken by a command, more when it lists the whole register."""
+    costo = settings.THROTTLE_COSTI.get(s[0], 1) if s else 0
+    if isinstance(costo, (list, tuple)):
+        costo = costo[1] if (len(s) < 2) or (s[1] == 'tutti') else costo[0]
+    return costo
+
+
+def ruolo_utente(t_user: str) -> str:
+    """Role whose limits apply to the user, unknown and inactive users get the ones of IS."""
+    if settings.ISCRITTI_SNAPSHOT:
+        trovati = [(iscritto.role, iscritto.active) for iscritto in snapshot_iscritti().per_telegram_id(t_user)]
+    else:
+        trovati = list(
+            Iscritti.objects.filter(gruppo=gruppo_corrente(), telegram_id__iexact=t_user).values_list('role', 'active')[:2]
+        )
+    if len(trovati) == 1 and trovati[0][1]:
+        return trovati[0][0]
+    return 'IS'
+
+
+def consuma_gettoni(gruppo: Gruppi, utente: str, ruolo: str, costo: int):
+    """Takes the tokens of a command from the bucket of the user.
+
+    Returns ``(attesa, avvisa)``: the seconds to wait before the command can run, 0 when it
+    runs now, and whether the user still has to be told, only the first time in a row.
+    """
+    capacita, ricarica = settings.THROTTLE_LIMITI.get(ruolo, settings.THROTTLE_LIMITI['IS'])
+    # A command dearer than the whole bucket needs it full
+    costo = min(costo, capacita)
+    adesso = timezone.now()
+    with transaction.atomic():
+        bucket, creato = Gettoni.objects.select_for_update().get_or_create(
+            gruppo=gruppo, utente=utente, defaults={'gettoni': capacita, 'aggiornato': adesso}
+        )
+        gettoni = min(capacita, bucket.gettoni + (adesso - bucket.aggiornato).total_seconds() * ricarica)
+        if gettoni >= costo:
+            bucket.gettoni = gettoni - costo
+            bucket.aggiornato = adesso
+            bucket.avvisato_fino = None
+            bucket.save(update_fields=['gettoni', 'aggiornato', 'avvisato_fino'])
+            return 0, False
+        attesa = math.ceil((costo - gettoni) / ricarica)
+        if bucket.avvisato_fino is not None and bucket.avvisato_fino > adesso:
+            return attesa, False
+        bucket.avvisato_fino = adesso + timedelta(seconds=attesa)
+        bucket.save(update_fields=['avvisato_fino'])
+        return attesa, True
@@ -0,0 +1,68 @@
+import io
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import BaseCommand
+
+from coca_bot.gruppi import get_gruppo
+from coca_bot.webhook import WebhookHandler
+
+
+class Command(BaseCommand):
+    help = 'Misura il costo per richiesta della catena di middleware completa e di quella dei webhook'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--richieste', type=int, default=2000, help='Richieste da inviare a ciascuna catena')
+        parser.add_argument('--gruppo', default=settings.DEFAULT_GRUPPO, help='Slug del gruppo del webhook')
+
+    def handle(self, *args, **options):
+        gruppo = get_gruppo(options['gruppo'])
+        if gruppo is None:
+            print(f'Gruppo non trovato: {options["gruppo"]}')
+            return
+        # A channel post is acknowledged before decoding, so only the request path is measured
+        body = json.dumps({'update_id': 1, 'channel_post': {'message_id': 1, 'text': 'bench'}}).encode()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': f'/webhooks/{gruppo.slug}/',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '443',
+            'HTTP_HOST': settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*' else 'localhost',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN': gruppo.impostazione('webhook_secret'),
+            'wsgi.input': None,
+            'wsgi.url_scheme': 'https',
+        }
+
+        completa = self.misura(WSGIHandler(), environ, body, options['richieste'])
+        webhook = self.misura(WebhookHandler(), environ, body, options['richieste'])
+        for nome, tempi in (('MIDDLEWARE', completa), ('WEBHOOK_MIDDLEWARE', webhook)):
+            print(f'{nome}: media {statistics.mean(tempi):.0f} µs, '
+                  f'p50 {self.percentile(tempi, 50):.0f} µs, p99 {self.percentile(tempi, 99):.0f} µs')
+        print(f'Risparmio medio per richiesta: {statistics.mean(completa) - statistics.mean(webhook):.0f} µs')
+
+    def misura(self, handler, environ: dict, body: bytes, richieste: int) -> list:
+        stati = []
+
+        def start_response(status, headers):
+            stati.append(status)
+
+        tempi = []
+        for _ in range(richieste):
+            richiesta = dict(environ, **{'wsgi.input': io.BytesIO(body)})
+            inizio = time.perf_counter()
+            risposta = handler(richiesta, start_response)
+            b''.join(risposta)
+            risposta.close()
+            tempi.append((time.perf_counter() - inizio) * 1e6)
+        if stati[-1] != '200 OK':
+            print(f'Risposta inattesa: {stati[-1]}')
+        return tempi
+
+    def percentile(self, valori: list, p: int) -> float:
+        ordinati = sorted(valori)
+        return ordinati[min(len(ordinati) - 1, len(ordinati) * p // 100)]
@@ -0,0 +1,34 @@
+import secrets
+
+from django.core.management import BaseCommand, CommandError
+
+from coca_bot.models import Gruppi
+
+
+class Command(BaseCommand):
+    help = 'Registra su Telegram il webhook di ogni gruppo attivo, con il secret_token controllato da SecretTokenMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Indirizzo pubblico del bot, ad esempio https://avellino1-coca-bot.herokuapp.com')
+        parser.add_argument('--gruppo', help='Slug del gruppo, tutti i gruppi attivi se omesso')
+        parser.add_argument('--genera', action='store_true',
+                            help='Genera e salva il secret dei gruppi che non ne hanno uno')
+
+    def handle(self, *args, **options):
+        gruppi = Gruppi.objects.filter(active=True)
+        if options['gruppo']:
+            gruppi = gruppi.filter(slug=options['gruppo'])
+        for gruppo in gruppi:
+            if not gruppo.impostazione('webhook_secret'):
+                if not options['genera']:
+                    raise CommandError(f'{gruppo.slug} non ha un webhook_secret, impostalo o usa --genera')
+                # Telegram accepts 1-256 characters among A-Z, a-z, 0-9, _ and -
+                gruppo.webhook_secret = secrets.token_urlsafe(32)
+                gruppo.save(update_fields=['webhook_secret'])
+            response = gruppo.telegram().post('setWebhook', {
+                'url': f"{options['url'].rstrip('/')}/webhooks/{gruppo.slug}/",
+                'secret_token': gruppo.impostazione('webhook_secret'),
+            })
+            if response.status_code != 200:
+                raise CommandError(f'{gruppo.slug}: {response.status_code} {response.content}')
+            print(f'Webhook impostato per {gruppo.nome}')
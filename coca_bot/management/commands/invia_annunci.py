@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+from django.conf import settings
+
+from utils.Broadcaster import Broadcaster
+
+
+class Command(BaseCommand):
+    help = 'Riprende gli annunci rimasti a metà dopo un riavvio'
+
+    def handle(self, *args, **options):
+        broadcaster = Broadcaster(settings.ANNUNCI_MESSAGES_PER_SECOND)
+        ripresi = broadcaster.resume()
+        print(f'Ho ripreso {ripresi} annunci')
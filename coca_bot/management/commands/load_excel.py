@@ -1,19 +1,39 @@
-from django.core.management import BaseCommand
 from django.conf import settings
-from django.db import transaction
-
-import pandas as pd
+from django.core.management import BaseCommand, CommandError
 
+from coca_bot.models import Gruppi
+from coca_bot.profili import profila, profilazione_per
+from coca_bot.tracing import TRACER
 from utils.DataLoader import DataLoader
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--gruppo', help='Slug del gruppo da aggiornare, tutti i gruppi attivi se omesso')
+        parser.add_argument('documenti', nargs='*', help='File excel da caricare al posto di quelli configurati')
+
     def handle(self, *args, **options):
-        url = settings.SHAREPOINT_URL
-        username = settings.SHAREPOINT_USERNAME
-        password = settings.SHAREPOINT_PASSWORD
-        documents = settings.DOCUMENTS_URL
-        loader = DataLoader(url, username, password, documents)
-        print("Caricamento file excel")
-        (nuovi, aggiornati) = loader.loadRemoteIntoDb()
-        print(f'Ho inserito {nuovi} nuovi iscritti e aggiornato gli altri {aggiornati}')
\ No newline at end of file
+        if options['documenti'] and not options['gruppo']:
+            # The workbooks of one group would replace the register of every other group
+            raise CommandError('Indica il gruppo con --gruppo quando passi i file excel')
+        gruppi = Gruppi.objects.filter(active=True)
+        if options['gruppo']:
+            gruppi = gruppi.filter(slug=options['gruppo'])
+        for gruppo in gruppi:
+            url = gruppo.impostazione('sharepoint_url')
+            username = gruppo.impostazione('sharepoint_username')
+            password = gruppo.impostazione('sharepoint_password')
+            documents = options['documenti'] or gruppo.impostazione('documents_url')
+            loader = DataLoader(url, username, password, documents, gruppo, settings.DATALOADER_PROCESSES)
+            print(f"Caricamento file excel per {gruppo.nome}")
+            profilazione = profilazione_per('load_excel', gruppo)
+            with TRACER.trace('load_excel', gruppo=gruppo.slug):
+                if profilazione is None:
+                    report = loader.loadRemoteIntoDb()
+                else:
+                    with profila('load_excel', profilazione, gruppo):
+                        report = loader.loadRemoteIntoDb()
+            print(report.summary())
+            print('\n'.join(report.details()))
+            gruppo.notifica_admin(f'Aggiornamento iscritti completato\n{report.summary()}')
+        TRACER.join()
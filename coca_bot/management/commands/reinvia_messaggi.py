@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from coca_bot.recapiti import reinvia_non_consegnati
+
+
+class Command(BaseCommand):
+    help = 'Reinvia i messaggi che non è stato possibile consegnare mentre Telegram non era raggiungibile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, help='Numero massimo di messaggi da reinviare')
+
+    def handle(self, *args, **options):
+        esiti = reinvia_non_consegnati(options['limite'])
+        print(f'Consegnati: {esiti["consegnati"]}\nScartati: {esiti["scartati"]}\nIn attesa: {esiti["in_attesa"]}')
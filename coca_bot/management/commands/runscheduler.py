@@ -0,0 +1,48 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from coca_bot.scheduler import JOBS, acquisisci_lease, da_eseguire, esegui, rilascia_lease
+
+LEASE = 'runscheduler'
+
+
+class Command(BaseCommand):
+    help = 'Esegue periodicamente la sincronizzazione degli iscritti, la pulizia dei log, il ricalcolo delle statistiche, il reinvio dei messaggi e la ripresa degli annunci'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Esegue i job scaduti una volta sola ed esce')
+        parser.add_argument('--job', action='append', help='Esegue subito il job indicato, anche se non è scaduto')
+
+    def handle(self, *args, **options):
+        proprietario = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            while True:
+                close_old_connections()
+                if acquisisci_lease(LEASE, proprietario, settings.SCHEDULER_LEASE_SECONDS):
+                    self.tick(proprietario, options['job'] or [])
+                elif options['once'] or options['job']:
+                    print('Lo scheduler è già in esecuzione su un\'altra istanza')
+                if options['once'] or options['job']:
+                    break
+                time.sleep(settings.SCHEDULER_TICK_SECONDS)
+        finally:
+            rilascia_lease(LEASE, proprietario)
+
+    def tick(self, proprietario: str, forzati: list):
+        for job, impostazione, funzione in JOBS:
+            intervallo = getattr(settings, impostazione)
+            if job in forzati or (not forzati and intervallo > 0 and da_eseguire(job, intervallo)):
+                # Renewed before every job and by the long jobs between their steps, a sync longer
+                # than the lease could let another instance in
+                if not acquisisci_lease(LEASE, proprietario, settings.SCHEDULER_LEASE_SECONDS):
+                    return
+                esecuzione = esegui(
+                    job, funzione, proprietario,
+                    lambda: acquisisci_lease(LEASE, proprietario, settings.SCHEDULER_LEASE_SECONDS)
+                )
+                print(f'{job}: {esecuzione.esito} in {esecuzione.durata_ms} ms\n{esecuzione.dettaglio}')
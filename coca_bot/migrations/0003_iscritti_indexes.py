@@ -0,0 +1,21 @@
+# Generated by Django 3.1.4 on 2026-10-19 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0002_iscritti_telegram_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='iscritti',
+            index=models.Index(fields=['active', 'branca'], name='coca_bot_is_active_768eac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='iscritti',
+            index=models.Index(fields=['coca', 'authcode'], name='coca_bot_is_coca_2d5f2c_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-19 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0003_iscritti_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applogs',
+            name='update_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.4 on 2026-10-19 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0004_applogs_update_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Annunci',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato', models.DateTimeField(auto_now_add=True)),
+                ('aggiornato', models.DateTimeField(auto_now=True)),
+                ('autore', models.TextField()),
+                ('chat_id', models.TextField()),
+                ('testo', models.TextField()),
+                ('branca', models.TextField(blank=True, null=True)),
+                ('ultimo_iscritto', models.IntegerField(default=0)),
+                ('consegnati', models.IntegerField(default=0)),
+                ('bloccati', models.IntegerField(default=0)),
+                ('falliti', models.IntegerField(default=0)),
+                ('completato', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Annuncio',
+                'verbose_name_plural': 'Annunci',
+            },
+        ),
+    ]
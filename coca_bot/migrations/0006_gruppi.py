@@ -0,0 +1,69 @@
+# Generated by Django 3.1.4 on 2026-10-19 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def crea_gruppo_predefinito(apps, schema_editor):
+    """Assigns the existing data to the group the bot served before groups existed."""
+    Gruppi = apps.get_model('coca_bot', 'Gruppi')
+    gruppo, created = Gruppi.objects.get_or_create(slug=settings.DEFAULT_GRUPPO, defaults={'nome': 'Avellino 1'})
+    for model_name in ('Iscritti', 'AppLogs', 'Annunci'):
+        apps.get_model('coca_bot', model_name).objects.filter(gruppo__isnull=True).update(gruppo=gruppo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0005_annunci'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gruppi',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(help_text='Percorso del webhook: /webhooks/<slug>/', unique=True)),
+                ('nome', models.TextField()),
+                ('bot_token', models.TextField(blank=True, default='')),
+                ('bot_username', models.TextField(blank=True, default='')),
+                ('sharepoint_url', models.TextField(blank=True, default='')),
+                ('sharepoint_username', models.TextField(blank=True, default='')),
+                ('sharepoint_password', models.TextField(blank=True, default='')),
+                ('documents_url', models.TextField(blank=True, default='')),
+                ('email_from', models.TextField(blank=True, default='')),
+                ('active', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Gruppo',
+                'verbose_name_plural': 'Gruppi',
+            },
+        ),
+        migrations.AlterField(
+            model_name='applogs',
+            name='update_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='iscritti',
+            name='codice_fiscale',
+            field=models.TextField(),
+        ),
+        migrations.AddField(
+            model_name='annunci',
+            name='gruppo',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.AddField(
+            model_name='applogs',
+            name='gruppo',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.AddField(
+            model_name='iscritti',
+            name='gruppo',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.RunPython(crea_gruppo_predefinito, migrations.RunPython.noop),
+    ]
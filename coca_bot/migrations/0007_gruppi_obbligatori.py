@@ -0,0 +1,37 @@
+# Generated by Django 3.1.4 on 2026-10-19 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0006_gruppi'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='annunci',
+            name='gruppo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.AlterField(
+            model_name='applogs',
+            name='gruppo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.AlterField(
+            model_name='iscritti',
+            name='gruppo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi'),
+        ),
+        migrations.AddConstraint(
+            model_name='applogs',
+            constraint=models.UniqueConstraint(fields=('gruppo', 'update_id'), name='applogs_gruppo_update_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='iscritti',
+            constraint=models.UniqueConstraint(fields=('gruppo', 'codice_fiscale'), name='iscritti_gruppo_codice_fiscale'),
+        ),
+    ]
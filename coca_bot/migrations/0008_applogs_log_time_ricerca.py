@@ -0,0 +1,41 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+# The admin searches compare UPPER() of the column, PostgreSQL only uses an index built on the same expression
+INDICI_RICERCA = [
+    ('iscritti_upper_codice_socio', 'UPPER(codice_socio)'),
+    ('iscritti_upper_codice_fiscale', 'UPPER(codice_fiscale)'),
+    ('iscritti_upper_cognome', 'UPPER(cognome) text_pattern_ops'),
+    ('iscritti_upper_nome', 'UPPER(nome) text_pattern_ops'),
+]
+
+
+def crea_indici_ricerca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nome, espressione in INDICI_RICERCA:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {nome} ON coca_bot_iscritti ({espressione})')
+
+
+def elimina_indici_ricerca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nome, espressione in INDICI_RICERCA:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {nome}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0007_gruppi_obbligatori'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='applogs',
+            name='log_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(crea_indici_ricerca, elimina_indici_ricerca),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0008_applogs_log_time_ricerca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profilazioni',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato', models.DateTimeField(auto_now_add=True)),
+                ('autore', models.TextField()),
+                ('chat_id', models.TextField()),
+                ('comando', models.TextField()),
+                ('rimanenti', models.IntegerField(default=1)),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Profilazione',
+                'verbose_name_plural': 'Profilazioni',
+            },
+        ),
+        migrations.CreateModel(
+            name='Profili',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato', models.DateTimeField(auto_now_add=True)),
+                ('comando', models.TextField()),
+                ('durata_ms', models.IntegerField(default=0)),
+                ('campioni', models.IntegerField(default=0)),
+                ('dati', models.TextField(blank=True)),
+                ('gruppo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='coca_bot.gruppi')),
+                ('profilazione', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='coca_bot.profilazioni')),
+            ],
+            options={
+                'verbose_name': 'Profilo',
+                'verbose_name_plural': 'Profili',
+            },
+        ),
+    ]
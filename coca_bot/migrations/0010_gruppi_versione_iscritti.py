@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0009_profili'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gruppi',
+            name='versione_iscritti',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0010_gruppi_versione_iscritti'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statistiche',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimensione', models.TextField()),
+                ('ordine', models.IntegerField(default=0)),
+                ('valore', models.TextField()),
+                ('totale', models.IntegerField(default=0)),
+                ('aggiornato', models.DateTimeField()),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Statistica',
+                'verbose_name_plural': 'Statistiche',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='statistiche',
+            constraint=models.UniqueConstraint(fields=('gruppo', 'dimensione', 'valore'), name='statistiche_gruppo_dimensione_valore'),
+        ),
+    ]
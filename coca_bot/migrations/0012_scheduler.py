@@ -0,0 +1,46 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0011_statistiche'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blocchi',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(unique=True)),
+                ('proprietario', models.TextField()),
+                ('scadenza', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Blocco',
+                'verbose_name_plural': 'Blocchi',
+            },
+        ),
+        migrations.CreateModel(
+            name='Esecuzioni',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.TextField()),
+                ('proprietario', models.TextField()),
+                ('inizio', models.DateTimeField(db_index=True)),
+                ('durata_ms', models.IntegerField(blank=True, null=True)),
+                ('esito', models.CharField(choices=[('corso', 'In corso'), ('ok', 'Completato'), ('errore', 'Errore')], default='corso', max_length=8)),
+                ('dettaglio', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'verbose_name': 'Esecuzione',
+                'verbose_name_plural': 'Esecuzioni',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='esecuzioni',
+            index=models.Index(fields=['job', 'inizio'], name='coca_bot_es_job_365495_idx'),
+        ),
+    ]
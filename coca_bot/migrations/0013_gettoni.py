@@ -0,0 +1,33 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0012_scheduler'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gettoni',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('utente', models.TextField()),
+                ('gettoni', models.FloatField(default=0)),
+                ('aggiornato', models.DateTimeField()),
+                ('avvisato_fino', models.DateTimeField(blank=True, null=True)),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Gettoni',
+                'verbose_name_plural': 'Gettoni',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='gettoni',
+            constraint=models.UniqueConstraint(fields=('gruppo', 'utente'), name='gettoni_gruppo_utente'),
+        ),
+    ]
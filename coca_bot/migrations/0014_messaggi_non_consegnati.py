@@ -0,0 +1,31 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0013_gettoni'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessaggiNonConsegnati',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato', models.DateTimeField(auto_now_add=True)),
+                ('metodo', models.TextField()),
+                ('dati', models.TextField()),
+                ('errore', models.TextField(blank=True, default='')),
+                ('tentativi', models.IntegerField(default=0)),
+                ('stato', models.CharField(choices=[('attesa', 'In attesa'), ('consegnato', 'Consegnato'), ('scartato', 'Scartato')], db_index=True, default='attesa', max_length=10)),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Messaggio non consegnato',
+                'verbose_name_plural': 'Messaggi non consegnati',
+            },
+        ),
+    ]
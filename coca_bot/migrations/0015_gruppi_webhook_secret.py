@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0014_messaggi_non_consegnati'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gruppi',
+            name='webhook_secret',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.4 on 2026-10-19 11:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0015_gruppi_webhook_secret'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChiaviApi',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(help_text='Strumento che usa la chiave')),
+                ('chiave', models.TextField(help_text='Inviata come Authorization: Bearer <chiave>', unique=True)),
+                ('campi', models.TextField(blank=True, default='')),
+                ('active', models.BooleanField(default=True)),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Chiave API',
+                'verbose_name_plural': 'Chiavi API',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.4 on 2026-10-19 15:02
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def calcola_impronte(apps, schema_editor):
+    ChiaviApi = apps.get_model('coca_bot', 'ChiaviApi')
+    for chiave in ChiaviApi.objects.all():
+        chiave.impronta = hashlib.sha256(chiave.chiave.encode()).hexdigest()
+        chiave.save(update_fields=['impronta'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0016_chiavi_api'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chiaviapi',
+            name='impronta',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        # The keys already handed out keep working, only their hash is kept
+        migrations.RunPython(calcola_impronte, migrations.RunPython.noop),
+    ]
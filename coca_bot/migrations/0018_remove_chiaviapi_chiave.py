@@ -0,0 +1,23 @@
+# Generated by Django 3.1.4 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0017, PostgreSQL cannot alter the table in the transaction that updated its rows
+
+    dependencies = [
+        ('coca_bot', '0017_chiaviapi_impronta'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chiaviapi',
+            name='chiave',
+        ),
+        migrations.AlterField(
+            model_name='chiaviapi',
+            name='impronta',
+            field=models.CharField(editable=False, help_text='SHA-256 della chiave inviata come Authorization: Bearer <chiave>', max_length=64, unique=True),
+        ),
+    ]
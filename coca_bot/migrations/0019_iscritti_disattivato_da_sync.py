@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0018_remove_chiaviapi_chiave'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iscritti',
+            name='disattivato_da_sync',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.4 on 2026-10-19 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coca_bot', '0019_iscritti_disattivato_da_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Documenti',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('caricato', models.DateTimeField()),
+                ('gruppo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coca_bot.gruppi')),
+            ],
+            options={
+                'verbose_name': 'Documento',
+                'verbose_name_plural': 'Documenti',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documenti',
+            constraint=models.UniqueConstraint(fields=('gruppo', 'nome'), name='documenti_gruppo_nome'),
+        ),
+    ]
@@ -1,11 +1,89 @@
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from utils.TelegramClient import TelegramClient
+
 
 # Create your models here.
+class Gruppi(models.Model):
+    # Blank credentials fall back to the process-wide settings
+    IMPOSTAZIONI = {
+        'bot_token': 'TUTORIAL_BOT_TOKEN',
+        'bot_username': 'TELEGRAM_BOT_USERNAME',
+        'sharepoint_url': 'SHAREPOINT_URL',
+        'sharepoint_username': 'SHAREPOINT_USERNAME',
+        'sharepoint_password': 'SHAREPOINT_PASSWORD',
+        'documents_url': 'DOCUMENTS_URL',
+        'email_from': 'EMAIL_FROM',
+        'webhook_secret': 'TELEGRAM_WEBHOOK_SECRET',
+    }
+
+    slug = models.SlugField(unique=True, help_text="Percorso del webhook: /webhooks/<slug>/")
+    nome = models.TextField(null=False)
+    bot_token = models.TextField(blank=True, default='')
+    bot_username = models.TextField(blank=True, default='')
+    sharepoint_url = models.TextField(blank=True, default='')
+    sharepoint_username = models.TextField(blank=True, default='')
+    sharepoint_password = models.TextField(blank=True, default='')
+    documents_url = models.TextField(blank=True, default='')
+    email_from = models.TextField(blank=True, default='')
+    # secret_token passed to setWebhook, Telegram sends it back in X-Telegram-Bot-Api-Secret-Token
+    webhook_secret = models.TextField(blank=True, default='')
+    active = models.BooleanField(null=False, default=True)
+    # Bumped on every write to the members of the group, see coca_bot.snapshot
+    versione_iscritti = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name = 'Gruppo'
+        verbose_name_plural = 'Gruppi'
+
+    def __str__(self):
+        return self.nome
+
+    def save(self, *args, **kwargs):
+        # Never write back a versione_iscritti read before the last bump
+        if self.pk is not None and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'versione_iscritti'
+            ]
+        super().save(*args, **kwargs)
+
+    def impostazione(self, campo: str) -> str:
+        return getattr(self, campo) or getattr(settings, self.IMPOSTAZIONI[campo])
+
+    def telegram(self) -> TelegramClient:
+        if getattr(self, '_telegram', None) is None:
+            self._telegram = TelegramClient(
+                self.impostazione('bot_token'),
+                settings.TELEGRAM_URL,
+                timeout=(settings.TELEGRAM_CONNECT_TIMEOUT, settings.TELEGRAM_READ_TIMEOUT),
+                breaker=TelegramClient.breakerFor(
+                    settings.TELEGRAM_URL, settings.TELEGRAM_BREAKER_FAILURES, settings.TELEGRAM_BREAKER_RESET_SECONDS
+                ),
+            )
+        return self._telegram
+
+    def notifica_admin(self, testo: str):
+        """Sends a plain text message to every active admin registered on Telegram, kept for later when it is down."""
+        # recapiti imports the models
+        from coca_bot.recapiti import invia_o_salva
+
+        admin_set = Iscritti.objects.filter(
+            gruppo=self, role__in=['SA', 'AD'], active=True, telegram_id__isnull=False
+        ).exclude(telegram_id='')
+        for telegram_id in admin_set.values_list('telegram_id', flat=True):
+            invia_o_salva(self, 'sendMessage', {"chat_id": telegram_id[2:], "text": testo})
+
+
 class Iscritti(models.Model):
     id = models.AutoField(primary_key=True)
-    codice_fiscale = models.TextField(null=False, unique=True)
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.PROTECT)
+    codice_fiscale = models.TextField(null=False)
     codice_socio = models.TextField(null=False)
     nome = models.TextField(null=False)
     cognome = models.TextField(null=False)
@@ -37,6 +115,9 @@ class Iscritti(models.Model):
     telegram_id = models.TextField(null=True, blank=True)
     authcode = models.TextField(null=True, blank=True)
     active = models.BooleanField(null=False, default=True)
+    # Turned off by a sync because missing from the census, the next sync finding it turns it back on.
+    # Members turned off from the bot keep this False and stay off
+    disattivato_da_sync = models.BooleanField(null=False, default=False)
     role = models.CharField(max_length=2, choices=(
         ('SA', _('Super Admin')),
         ('AD', _('Admin')),
@@ -47,13 +128,215 @@ class Iscritti(models.Model):
     class Meta:
         verbose_name = 'Iscritto'
         verbose_name_plural = 'Iscritti'
+        indexes = [
+            models.Index(fields=['active', 'branca']),
+            models.Index(fields=['coca', 'authcode']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['gruppo', 'codice_fiscale'], name='iscritti_gruppo_codice_fiscale'),
+        ]
 
 
 class AppLogs(models.Model):
-    log_time = models.DateTimeField(auto_now_add=True)
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.PROTECT)
+    log_time = models.DateTimeField(auto_now_add=True, db_index=True)
     username = models.TextField(blank=False)
     command = models.TextField(blank=False)
+    update_id = models.BigIntegerField(null=True, blank=True)
 
     class Meta:
         verbose_name = 'Log'
-        verbose_name_plural = 'Logs'
\ No newline at end of file
+        verbose_name_plural = 'Logs'
+        constraints = [
+            models.UniqueConstraint(fields=['gruppo', 'update_id'], name='applogs_gruppo_update_id'),
+        ]
+
+class Annunci(models.Model):
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.PROTECT)
+    creato = models.DateTimeField(auto_now_add=True)
+    aggiornato = models.DateTimeField(auto_now=True)
+    autore = models.TextField(blank=False)
+    chat_id = models.TextField(blank=False)
+    testo = models.TextField(blank=False)
+    branca = models.TextField(null=True, blank=True)
+    ultimo_iscritto = models.IntegerField(default=0)
+    consegnati = models.IntegerField(default=0)
+    bloccati = models.IntegerField(default=0)
+    falliti = models.IntegerField(default=0)
+    completato = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = 'Annuncio'
+        verbose_name_plural = 'Annunci'
+
+    def destinatari(self):
+        iscritti_set = Iscritti.objects.filter(
+            gruppo=self.gruppo_id,
+            telegram_id__isnull=False,
+            active=True,
+            id__gt=self.ultimo_iscritto,
+        ).exclude(telegram_id='')
+        if self.branca is not None:
+            iscritti_set = iscritti_set.filter(branca=self.branca)
+        return iscritti_set.order_by('id')
+
+
+class Profilazioni(models.Model):
+    """Request to profile the next dispatches of a command, made with /profila."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.PROTECT)
+    creato = models.DateTimeField(auto_now_add=True)
+    autore = models.TextField(blank=False)
+    chat_id = models.TextField(blank=False)
+    comando = models.TextField(blank=False)
+    rimanenti = models.IntegerField(default=1)
+
+    class Meta:
+        verbose_name = 'Profilazione'
+        verbose_name_plural = 'Profilazioni'
+
+
+class Profili(models.Model):
+    """Stacks sampled during one profiled dispatch, in the folded format of flamegraph.pl."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.PROTECT, null=True, blank=True)
+    profilazione = models.ForeignKey(Profilazioni, on_delete=models.SET_NULL, null=True, blank=True)
+    creato = models.DateTimeField(auto_now_add=True)
+    comando = models.TextField(blank=False)
+    durata_ms = models.IntegerField(default=0)
+    campioni = models.IntegerField(default=0)
+    dati = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = 'Profilo'
+        verbose_name_plural = 'Profili'
+
+
+class Statistiche(models.Model):
+    """Headcount of the active members of a group for one value of a dimension, recomputed after each sync."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.CASCADE)
+    dimensione = models.TextField(blank=False)
+    ordine = models.IntegerField(default=0)
+    valore = models.TextField(blank=False)
+    totale = models.IntegerField(default=0)
+    aggiornato = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Statistica'
+        verbose_name_plural = 'Statistiche'
+        constraints = [
+            models.UniqueConstraint(fields=['gruppo', 'dimensione', 'valore'], name='statistiche_gruppo_dimensione_valore'),
+        ]
+
+
+class Documenti(models.Model):
+    """SHA-256 of a census workbook as it was when last loaded into the group register."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.CASCADE)
+    nome = models.TextField(blank=False)
+    checksum = models.CharField(max_length=64)
+    caricato = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Documento'
+        verbose_name_plural = 'Documenti'
+        constraints = [
+            models.UniqueConstraint(fields=['gruppo', 'nome'], name='documenti_gruppo_nome'),
+        ]
+
+
+class Blocchi(models.Model):
+    """Lease held by one process at a time, renewed while it keeps running."""
+    nome = models.TextField(unique=True)
+    proprietario = models.TextField(blank=False)
+    scadenza = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Blocco'
+        verbose_name_plural = 'Blocchi'
+
+
+class Esecuzioni(models.Model):
+    """One run of a scheduler job."""
+    job = models.TextField(blank=False)
+    proprietario = models.TextField(blank=False)
+    inizio = models.DateTimeField(db_index=True)
+    durata_ms = models.IntegerField(null=True, blank=True)
+    esito = models.CharField(max_length=8, choices=(
+        ('corso', _('In corso')),
+        ('ok', _('Completato')),
+        ('errore', _('Errore')),
+    ), default='corso')
+    dettaglio = models.TextField(blank=True, default='')
+
+    class Meta:
+        verbose_name = 'Esecuzione'
+        verbose_name_plural = 'Esecuzioni'
+        indexes = [
+            models.Index(fields=['job', 'inizio']),
+        ]
+
+
+class Gettoni(models.Model):
+    """Token bucket of a Telegram user, shared by every worker."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.CASCADE)
+    utente = models.TextField(blank=False)
+    gettoni = models.FloatField(default=0)
+    aggiornato = models.DateTimeField()
+    # The user was told to wait until then, further messages are dropped silently
+    avvisato_fino = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Gettoni'
+        verbose_name_plural = 'Gettoni'
+        constraints = [
+            models.UniqueConstraint(fields=['gruppo', 'utente'], name='gettoni_gruppo_utente'),
+        ]
+
+
+class MessaggiNonConsegnati(models.Model):
+    """Bot API call that failed because Telegram was unreachable, replayed by reinvia_messaggi."""
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.CASCADE)
+    creato = models.DateTimeField(auto_now_add=True)
+    metodo = models.TextField(blank=False)
+    # JSON of the parameters of the call
+    dati = models.TextField(blank=False)
+    errore = models.TextField(blank=True, default='')
+    tentativi = models.IntegerField(default=0)
+    stato = models.CharField(max_length=10, choices=(
+        ('attesa', _('In attesa')),
+        ('consegnato', _('Consegnato')),
+        ('scartato', _('Scartato')),
+    ), default='attesa', db_index=True)
+
+    class Meta:
+        verbose_name = 'Messaggio non consegnato'
+        verbose_name_plural = 'Messaggi non consegnati'
+
+
+class ChiaviApi(models.Model):
+    """Token of another group tool reading the members through /api/<slug>/iscritti/.
+
+    Only the SHA-256 of the key is stored, the key itself is shown once when it is generated.
+    """
+    gruppo = models.ForeignKey(Gruppi, on_delete=models.CASCADE)
+    nome = models.TextField(blank=False, help_text="Strumento che usa la chiave")
+    impronta = models.CharField(max_length=64, unique=True, editable=False,
+                                help_text="SHA-256 della chiave inviata come Authorization: Bearer <chiave>")
+    # Comma separated fields the tool may read, empty for every field of API_CAMPI
+    campi = models.TextField(blank=True, default='')
+    active = models.BooleanField(null=False, default=True)
+
+    class Meta:
+        verbose_name = 'Chiave API'
+        verbose_name_plural = 'Chiavi API'
+
+    def __str__(self):
+        return self.nome
+
+    @staticmethod
+    def impronta_di(chiave: str) -> str:
+        return hashlib.sha256(chiave.encode()).hexdigest()
+
+    def genera(self) -> str:
+        """Sets a new random key, returns it in clear: it cannot be read back once saved."""
+        chiave = secrets.token_urlsafe(32)
+        self.impronta = self.impronta_di(chiave)
+        return chiave
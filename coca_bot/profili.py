@@ -0,0 +1,116 @@
+import contextlib
+import threading
+import time
+import traceback
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from coca_bot.gruppi import gruppo_corrente
+from coca_bot.models import Gruppi, Profilazioni, Profili
+from coca_bot.recapiti import invia_o_salva
+from utils.Profiler import Profiler
+
+
+def _leggi_ambiente(valore: str) -> dict:
+    """Parses PROFILA_COMANDI, e.g. "info:3,load_excel" -> {'info': 3, 'load_excel': 1}."""
+    comandi = {}
+    for voce in valore.split(','):
+        comando, _, volte = voce.strip().partition(':')
+        if comando:
+            comandi[comando] = int(volte or 1)
+    return comandi
+
+
+# Commands armed from the environment, counted down by each process on its own
+_da_ambiente = _leggi_ambiente(settings.PROFILA_COMANDI)
+_lock = threading.Lock()
+
+# Commands armed with /profila: gruppo id -> (loaded at, {comando: profilazione id})
+_armati = {}
+
+
+def profilazione_per(comando: str, gruppo: Gruppi = None):
+    """Claims one profiled dispatch of the command.
+
+    Returns the Profilazioni to record it under, unsaved when it was armed from the
+    environment, or None when the command should run without the profiler.
+    """
+    with _lock:
+        if _da_ambiente.get(comando, 0) > 0:
+            _da_ambiente[comando] -= 1
+            return Profilazioni(comando=comando, chat_id='')
+
+    gruppo = gruppo or gruppo_corrente()
+    cached = _armati.get(gruppo.id)
+    if cached is None or time.monotonic() - cached[0] >= settings.PROFILA_CACHE_SECONDS:
+        armati = Profilazioni.objects.filter(gruppo=gruppo, rimanenti__gt=0).values_list('comando', 'id')
+        cached = (time.monotonic(), dict(armati))
+        _armati[gruppo.id] = cached
+    profilazione_id = cached[1].get(comando)
+    if profilazione_id is None:
+        return None
+    # Several processes share the count, only the ones that decrement it get to profile
+    if Profilazioni.objects.filter(id=profilazione_id, rimanenti__gt=0).update(rimanenti=F('rimanenti') - 1) == 1:
+        return Profilazioni.objects.get(id=profilazione_id)
+    cached[1].pop(comando, None)
+    return None
+
+
+@contextlib.contextmanager
+def profila(comando: str, profilazione: Profilazioni, gruppo: Gruppi = None):
+    """Samples the block, then stores the profile and sends it to whoever asked for it.
+
+    Storing or sending the profile never fails the command, nor hides the error it raised.
+    """
+    gruppo = gruppo or gruppo_corrente()
+    profiler = Profiler(settings.PROFILA_INTERVALLO_MS / 1000)
+    try:
+        with profiler:
+            yield profiler
+    finally:
+        try:
+            profilo = Profili.objects.create(
+                gruppo=gruppo,
+                profilazione=profilazione if profilazione.pk else None,
+                comando=comando,
+                durata_ms=int(profiler.duration * 1000),
+                campioni=profiler.samples,
+                dati=profiler.folded(),
+            )
+            if profilazione.chat_id:
+                invia_profilo(profilo, profilazione.chat_id, gruppo)
+        except Exception:
+            traceback.print_exc()
+
+
+def invia_profilo(profilo: Profili, chat_id, gruppo: Gruppi = None):
+    """Sends the profile, when Telegram does not take it a notice pointing to /profila scarica is kept for later."""
+    gruppo = gruppo or gruppo_corrente()
+    descrizione = f'Profilo #{profilo.id} di /{profilo.comando}: {profilo.durata_ms} ms, {profilo.campioni} campioni'
+    if not profilo.dati:
+        # Telegram refuses empty documents
+        invia_o_salva(gruppo, 'sendMessage', {"chat_id": chat_id, "text": descrizione})
+        return
+    try:
+        response = gruppo.telegram().sendDocument(
+            f'profilo_{profilo.id}_{profilo.comando}.folded', profilo.dati.encode(), chat_id, descrizione
+        )
+        errore = None if response.status_code == 200 else f'{response.status_code} {response.reason}'
+    except requests.RequestException as e:
+        # Includes TelegramUnavailable, the breaker is open
+        errore = str(e)
+    if errore is not None:
+        print(f'Profilo #{profilo.id} non inviato: {errore}')
+        invia_o_salva(gruppo, 'sendMessage', {
+            "chat_id": chat_id,
+            "text": f'{descrizione}, non inviato. Scaricalo con /profila scarica {profilo.id}',
+        })
+
+
+@receiver([post_save, post_delete], sender=Profilazioni)
+def invalida_armati(sender, instance, **kwargs):
+    _armati.pop(instance.gruppo_id, None)
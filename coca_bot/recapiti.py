@@ -0,0 +1,65 @@
+import json
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from coca_bot.gruppi import gruppo_corrente
+from coca_bot.models import MessaggiNonConsegnati
+
+
+def salva_non_consegnato(metodo: str, dati: dict, errore: str, gruppo=None):
+    """Keeps a Bot API call that Telegram could not take, to be sent again by reinvia_non_consegnati."""
+    MessaggiNonConsegnati.objects.create(
+        gruppo=gruppo or gruppo_corrente(),
+        metodo=metodo,
+        dati=json.dumps(dati),
+        errore=errore,
+    )
+
+
+def invia_o_salva(gruppo, metodo: str, dati: dict):
+    """Calls the Bot API, returns None when Telegram is down or the breaker is open and the call was kept instead."""
+    try:
+        response = gruppo.telegram().post(metodo, dati)
+    except requests.RequestException as e:
+        salva_non_consegnato(metodo, dati, str(e), gruppo)
+        return None
+    if response.status_code == 429 or response.status_code >= 500:
+        salva_non_consegnato(metodo, dati, f'{response.status_code} {response.reason}', gruppo)
+        return None
+    return response
+
+
+def reinvia_non_consegnati(limite: int = None) -> dict:
+    """Sends the undelivered messages again in order, stopping at the first sign that Telegram is still down."""
+    esiti = {'consegnati': 0, 'scartati': 0, 'in_attesa': 0}
+    scadenza = timezone.now() - timedelta(hours=settings.NON_CONSEGNATI_MAX_ORE)
+    esiti['scartati'] += MessaggiNonConsegnati.objects.filter(stato='attesa', creato__lt=scadenza).update(stato='scartato')
+
+    messaggi = MessaggiNonConsegnati.objects.filter(stato='attesa').select_related('gruppo').order_by('id')
+    for messaggio in messaggi[:limite] if limite else messaggi.iterator(chunk_size=settings.QUERY_CHUNK_SIZE):
+        messaggio.tentativi += 1
+        try:
+            response = messaggio.gruppo.telegram().post(messaggio.metodo, json.loads(messaggio.dati))
+        except requests.RequestException as e:
+            messaggio.errore = str(e)
+            messaggio.save(update_fields=['tentativi', 'errore'])
+            break
+        if response.status_code == 200:
+            messaggio.stato = 'consegnato'
+            esiti['consegnati'] += 1
+        elif response.status_code == 429 or response.status_code >= 500:
+            messaggio.errore = f'{response.status_code} {response.reason}'
+            messaggio.save(update_fields=['tentativi', 'errore'])
+            break
+        else:
+            # Refused by Telegram, e.g. the user blocked the bot: sending it again would not help
+            messaggio.stato = 'scartato'
+            messaggio.errore = f'{response.status_code} {response.content[:500]}'
+            esiti['scartati'] += 1
+        messaggio.save(update_fields=['tentativi', 'errore', 'stato'])
+
+    esiti['in_attesa'] = MessaggiNonConsegnati.objects.filter(stato='attesa').count()
+    return esiti
@@ -0,0 +1,48 @@
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Models written while handling the current update, None outside of an update
+_scritture = contextvars.ContextVar('scritture', default=None)
+
+
+def inizia_update():
+    """Starts routing the reads of an update to the replica, returns the token for fine_update."""
+    return _scritture.set(set())
+
+
+def fine_update(token):
+    _scritture.reset(token)
+
+
+class ReplicaRouter(object):
+    """Sends the reads made while handling a Telegram update to the read replica.
+
+    Once the update writes a model, the following reads of that model go to the primary
+    so the update always sees its own writes. Everything else (admin, management
+    commands, background queues) keeps using the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        scritture = _scritture.get()
+        if scritture is None or REPLICA_DB_ALIAS not in settings.DATABASES:
+            return DEFAULT_DB_ALIAS
+        if model._meta.label in scritture:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        scritture = _scritture.get()
+        if scritture is not None:
+            scritture.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
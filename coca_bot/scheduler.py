@@ -0,0 +1,155 @@
+import contextvars
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from coca_bot.models import AppLogs, Blocchi, Esecuzioni, Gruppi
+from coca_bot.recapiti import reinvia_non_consegnati
+from coca_bot.statistiche import aggiorna_statistiche
+from utils.Broadcaster import Broadcaster
+from utils.DataLoader import DataLoader
+
+# Renews the lease of the scheduler running the current job, None when a job runs outside of runscheduler
+_rinnovo = contextvars.ContextVar('rinnovo_lease', default=None)
+
+
+class EsitoParziale(Exception):
+    """Raised by a job that completed only some of its steps, the message is the detail of the run."""
+
+
+def acquisisci_lease(nome: str, proprietario: str, durata: int) -> bool:
+    """Takes or renews the lease, returns False while another process holds an unexpired one."""
+    adesso = timezone.now()
+    scadenza = adesso + timedelta(seconds=durata)
+    preso = Blocchi.objects.filter(
+        Q(nome=nome) & (Q(proprietario=proprietario) | Q(scadenza__lt=adesso))
+    ).update(proprietario=proprietario, scadenza=scadenza)
+    if preso == 1:
+        return True
+    try:
+        with transaction.atomic():
+            Blocchi.objects.create(nome=nome, proprietario=proprietario, scadenza=scadenza)
+        return True
+    except IntegrityError:
+        return False
+
+
+def rilascia_lease(nome: str, proprietario: str):
+    Blocchi.objects.filter(nome=nome, proprietario=proprietario).delete()
+
+
+def rinnova_lease():
+    """Called by long jobs between their steps, stops the job once another instance took over."""
+    rinnovo = _rinnovo.get()
+    if rinnovo is not None and not rinnovo():
+        raise EsitoParziale('Lease dello scheduler perso, job interrotto')
+
+
+def sincronizza() -> str:
+    """Syncs every active group with its census workbooks, admins hear about it only when something changed.
+
+    Workbooks still matching the checksums of the last full load are downloaded but neither
+    parsed nor compared. A group that fails is recorded and the others are still synced.
+    """
+    esiti = []
+    falliti = 0
+    for gruppo in Gruppi.objects.filter(active=True):
+        rinnova_lease()
+        loader = DataLoader(
+            gruppo.impostazione('sharepoint_url'),
+            gruppo.impostazione('sharepoint_username'),
+            gruppo.impostazione('sharepoint_password'),
+            gruppo.impostazione('documents_url'),
+            gruppo,
+            settings.DATALOADER_PROCESSES,
+            incrementale=True,
+        )
+        try:
+            report = loader.loadRemoteIntoDb()
+        except Exception:
+            falliti += 1
+            esiti.append(f'{gruppo.slug}: errore\n{traceback.format_exc()}')
+            continue
+        if report.changed():
+            gruppo.notifica_admin(f'Aggiornamento iscritti completato\n{report.summary()}')
+        esiti.append(f'{gruppo.slug}\n{report.summary()}')
+    if falliti:
+        raise EsitoParziale('\n\n'.join(esiti))
+    return '\n\n'.join(esiti)
+
+
+def pulisci_log() -> str:
+    """Deletes the AppLogs older than LOG_RETENTION_DAYS, in batches to keep every transaction short."""
+    limite = timezone.now() - timedelta(days=settings.LOG_RETENTION_DAYS)
+    eliminati = 0
+    while True:
+        ids = list(AppLogs.objects.filter(log_time__lt=limite).values_list('id', flat=True)[:settings.QUERY_CHUNK_SIZE])
+        if len(ids) < 1:
+            break
+        eliminati += AppLogs.objects.filter(id__in=ids).delete()[0]
+    return f'Log eliminati: {eliminati}'
+
+
+def ricalcola_statistiche() -> str:
+    """Recomputes the statistics stored in the database, the age bands move with the date even without a sync.
+
+    The member snapshots and the admin filter values live in the memory of each web worker,
+    a job of this process cannot refresh them.
+    """
+    gruppi = list(Gruppi.objects.filter(active=True))
+    for gruppo in gruppi:
+        rinnova_lease()
+        aggiorna_statistiche(gruppo)
+    return f'Statistiche ricalcolate: {len(gruppi)} gruppi'
+
+
+def reinvia() -> str:
+    esiti = reinvia_non_consegnati()
+    return f'Consegnati: {esiti["consegnati"]}, scartati: {esiti["scartati"]}, in attesa: {esiti["in_attesa"]}'
+
+
+def riprendi_annunci() -> str:
+    """Resumes the announcements whose process stopped renewing their lease, as invia_annunci."""
+    ripresi = Broadcaster(settings.ANNUNCI_MESSAGES_PER_SECOND).resume()
+    return f'Annunci ripresi: {ripresi}'
+
+
+# Name, setting with the interval in seconds, function returning a summary of the run
+JOBS = [
+    ('sync', 'SCHEDULER_SYNC_SECONDS', sincronizza),
+    ('retention', 'SCHEDULER_RETENTION_SECONDS', pulisci_log),
+    ('statistiche', 'SCHEDULER_STATISTICHE_SECONDS', ricalcola_statistiche),
+    ('replay', 'SCHEDULER_REPLAY_SECONDS', reinvia),
+    ('resume', 'SCHEDULER_RESUME_SECONDS', riprendi_annunci),
+]
+
+
+def da_eseguire(job: str, intervallo: int) -> bool:
+    ultima = Esecuzioni.objects.filter(job=job).order_by('-inizio').values_list('inizio', flat=True).first()
+    return ultima is None or ultima + timedelta(seconds=intervallo) <= timezone.now()
+
+
+def esegui(job: str, funzione, proprietario: str, rinnovo=None) -> Esecuzioni:
+    """Runs a job and records its duration and outcome, rinnovo renews the lease of the scheduler."""
+    esecuzione = Esecuzioni.objects.create(job=job, proprietario=proprietario, inizio=timezone.now())
+    inizio = time.monotonic()
+    token = _rinnovo.set(rinnovo)
+    try:
+        esecuzione.dettaglio = funzione() or ''
+        esecuzione.esito = 'ok'
+    except EsitoParziale as e:
+        esecuzione.dettaglio = str(e)
+        esecuzione.esito = 'errore'
+    except Exception:
+        esecuzione.dettaglio = traceback.format_exc()
+        esecuzione.esito = 'errore'
+    finally:
+        _rinnovo.reset(token)
+    esecuzione.durata_ms = int((time.monotonic() - inizio) * 1000)
+    esecuzione.save(update_fields=['dettaglio', 'esito', 'durata_ms'])
+    return esecuzione
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from coca_bot.gruppi import gruppo_corrente
+from coca_bot.models import Gruppi, Iscritti
+
+# Fields kept for every member, enough for /info, /codicesocio and the role checks
+CAMPI = ('id', 'codice_socio', 'codice_fiscale', 'nome', 'cognome', 'sesso', 'data_di_nascita', 'comune_di_nascita',
+         'indirizzo', 'civico', 'comune', 'provincia', 'cap', 'informativa2a', 'informativa2b', 'consenso_immagini',
+         'branca', 'cellulare', 'email', 'livello_foca', 'role', 'telegram', 'telegram_id', 'authcode', 'active')
+
+# Shared by every request of the process: gruppo id -> (version checked at, SnapshotIscritti)
+_snapshot = {}
+_lock = threading.Lock()
+
+
+class IscrittoSnapshot(object):
+    """Read-only member record, with the attributes of Iscritti used by the read commands."""
+    __slots__ = CAMPI + ('ricerca',)
+    RUOLI = dict(Iscritti._meta.get_field('role').choices)
+
+    def __init__(self, valori: tuple):
+        for campo, valore in zip(CAMPI, valori):
+            setattr(self, campo, valore)
+        # Fields matched by the free text search of get_iscritti
+        self.ricerca = '\0'.join(
+            str(valore).lower() for valore in (self.cognome, self.nome, self.codice_socio, self.codice_fiscale, self.branca)
+        )
+
+    def get_role_display(self) -> str:
+        return str(self.RUOLI.get(self.role, self.role))
+
+
+class SnapshotIscritti(object):
+    """Every member of a group at a given version, with prebuilt lookups by telegram id and codice."""
+    __slots__ = ('versione', 'iscritti', 'per_telegram', 'per_codice')
+
+    def __init__(self, versione: int, righe):
+        self.versione = versione
+        self.iscritti = tuple(IscrittoSnapshot(riga) for riga in righe)
+        self.per_telegram = {}
+        self.per_codice = {}
+        for iscritto in self.iscritti:
+            if iscritto.telegram_id:
+                self.per_telegram.setdefault(iscritto.telegram_id.lower(), []).append(iscritto)
+            for codice in {iscritto.codice_socio.lower(), iscritto.codice_fiscale.lower()}:
+                self.per_codice.setdefault(codice, []).append(iscritto)
+
+    def cerca(self, search_string: str, show_only_active: bool = False, show_all: bool = False) -> list:
+        """Same members as get_iscritti, in id order."""
+        if show_all:
+            iscritti = self.iscritti
+        else:
+            testo = search_string.lower()
+            iscritti = [iscritto for iscritto in self.iscritti if testo in iscritto.ricerca]
+        if show_only_active:
+            iscritti = [iscritto for iscritto in iscritti if iscritto.active]
+        return list(iscritti)
+
+    def per_telegram_id(self, t_user: str) -> list:
+        return self.per_telegram.get(t_user.lower(), []) if t_user else []
+
+    def per_codice_socio_o_fiscale(self, codice: str, show_only_active: bool = False) -> list:
+        """Same members as get_iscritto_by_codice, in id order."""
+        iscritti = self.per_codice.get(codice.lower(), []) if codice else []
+        if show_only_active:
+            iscritti = [iscritto for iscritto in iscritti if iscritto.active]
+        return list(iscritti)
+
+
+def snapshot_iscritti(gruppo: Gruppi = None) -> SnapshotIscritti:
+    """Returns the snapshot of the group, rebuilt when another process or a sync bumped its version.
+
+    The version is read at most every ISCRITTI_SNAPSHOT_SECONDS, writes made by this
+    process drop its snapshot right away.
+    """
+    gruppo = gruppo or gruppo_corrente()
+    cached = _snapshot.get(gruppo.id)
+    if cached is not None and time.monotonic() - cached[0] < settings.ISCRITTI_SNAPSHOT_SECONDS:
+        return cached[1]
+    with _lock:
+        cached = _snapshot.get(gruppo.id)
+        if cached is not None and time.monotonic() - cached[0] < settings.ISCRITTI_SNAPSHOT_SECONDS:
+            return cached[1]
+        # Always from the primary, a lagging replica would pin old rows to the new version
+        versione = Gruppi.objects.using(DEFAULT_DB_ALIAS).values_list('versione_iscritti', flat=True).get(id=gruppo.id)
+        if cached is None or cached[1].versione != versione:
+            righe = Iscritti.objects.using(DEFAULT_DB_ALIAS).filter(gruppo=gruppo.id).order_by('id').values_list(*CAMPI)
+            snapshot = SnapshotIscritti(versione, righe)
+        else:
+            snapshot = cached[1]
+        _snapshot[gruppo.id] = (time.monotonic(), snapshot)
+        return snapshot
+
+
+def aggiorna_versione(gruppo_id: int):
+    """Marks the snapshots of the group as stale, call it after bulk writes that send no signals."""
+    Gruppi.objects.filter(id=gruppo_id).update(versione_iscritti=F('versione_iscritti') + 1)
+    _snapshot.pop(gruppo_id, None)
+
+
+@receiver([post_save, post_delete], sender=Iscritti)
+def invalida_snapshot(sender, instance, **kwargs):
+    aggiorna_versione(instance.gruppo_id)
@@ -0,0 +1,70 @@
+from datetime import date
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, CharField, Count, Value, When
+from django.utils import timezone
+
+from coca_bot.models import Gruppi, Iscritti, Statistiche
+
+# Upper bound of each age band, in years, and its label
+FASCE_ETA = [(12, 'Fino a 11 anni'), (17, 'Da 12 a 16 anni'), (21, 'Da 17 a 20 anni'), (31, 'Da 21 a 30 anni'),
+             (51, 'Da 31 a 50 anni'), (None, 'Oltre 50 anni')]
+
+# Dimensions in display order: name, title, field or expression grouped on, labels of the values
+DIMENSIONI = [
+    ('branca', 'Branca', 'branca', {}),
+    ('sesso', 'Sesso', 'sesso', {'M': 'Maschi', 'F': 'Femmine'}),
+    ('eta', 'Età', 'fascia_eta', {}),
+    ('livello_foca', 'Fo.Ca.', 'livello_foca', {None: 'Nessuno', '': 'Nessuno'}),
+    ('informativa2a', 'Consenso privacy 2.a', 'informativa2a', {True: 'Si', False: 'No'}),
+    ('informativa2b', 'Consenso privacy 2.b', 'informativa2b', {True: 'Si', False: 'No'}),
+    ('consenso_immagini', 'Consenso immagini', 'consenso_immagini', {True: 'Si', False: 'No'}),
+]
+
+
+def anni_fa(oggi: date, anni: int) -> date:
+    try:
+        return oggi.replace(year=oggi.year - anni)
+    except ValueError:
+        # 29 February in a non leap year
+        return oggi.replace(year=oggi.year - anni, day=28)
+
+
+def fascia_eta(oggi: date) -> Case:
+    """Label of the age band of each member, computed by the database."""
+    return Case(
+        *[When(data_di_nascita__gt=anni_fa(oggi, limite), then=Value(etichetta))
+          for limite, etichetta in FASCE_ETA if limite is not None],
+        default=Value(FASCE_ETA[-1][1]),
+        output_field=CharField(),
+    )
+
+
+def aggiorna_statistiche(gruppo: Gruppi) -> int:
+    """Recomputes the summary of the active members of the group, one grouped query per dimension."""
+    aggiornato = timezone.now()
+    # Replaces the stored summary, counted on the primary like every read-modify-write
+    attivi = Iscritti.objects.using(DEFAULT_DB_ALIAS).filter(gruppo=gruppo, active=True).annotate(fascia_eta=fascia_eta(aggiornato.date()))
+    ordine_eta = {etichetta: i for i, (limite, etichetta) in enumerate(FASCE_ETA)}
+
+    righe = [Statistiche(gruppo=gruppo, dimensione='totale', valore='Totale', totale=attivi.count(), aggiornato=aggiornato)]
+    for dimensione, titolo, campo, etichette in DIMENSIONI:
+        conteggi = {}
+        for valore, totale in attivi.order_by().values_list(campo).annotate(totale=Count('id')):
+            # Values sharing a label, like null and empty Fo.Ca., are counted together
+            etichetta = str(etichette.get(valore, valore))
+            conteggi[etichetta] = conteggi.get(etichetta, 0) + totale
+        for etichetta, totale in conteggi.items():
+            righe.append(Statistiche(
+                gruppo=gruppo,
+                dimensione=dimensione,
+                ordine=ordine_eta.get(etichetta, 0) if dimensione == 'eta' else 0,
+                valore=etichetta,
+                totale=totale,
+                aggiornato=aggiornato,
+            ))
+
+    with transaction.atomic():
+        Statistiche.objects.filter(gruppo=gruppo).delete()
+        Statistiche.objects.bulk_create(righe)
+    return len(righe)
@@ -1,3 +1,568 @@
-from django.test import TestCase
+import json
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+import requests
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from coca_bot import gruppi, profili, scheduler, snapshot, views
+from coca_bot.admin import PaginatorConteggioLimitato
+from coca_bot.models import Annunci, AppLogs, ChiaviApi, Documenti, Gruppi, Iscritti, MessaggiNonConsegnati, Profilazioni, Profili
+from coca_bot.routers import REPLICA_DB_ALIAS, ReplicaRouter, fine_update, inizia_update
+from coca_bot.statistiche import aggiorna_statistiche
+from utils.Broadcaster import Broadcaster
+from utils.DataLoader import DataLoader
+from utils.MailQueue import MailQueue
+from utils.TelegramClient import TelegramClient
+
+# Members and log lines of each fixture population, a command must run the same queries for all of them
+POPOLAZIONI = (1, 10, 50)
+
+# Command sent by the super admin -> (most SQL queries, most Telegram calls). Queries include the lookup
+# of the group, the log of the update and the load of the member snapshot, the caches are emptied before
+# every command. Both hold for every population: listings pack their rows, one call per row fails at 50.
+BUDGET = {
+    'start': (3, 1),
+    'help': (3, 1),
+    'boh': (3, 1),
+    'info tutti': (5, 7),
+    'info cognome1': (5, 2),
+    'codicesocio tutti': (5, 2),
+    'codicesocio 1000': (5, 1),
+    'abilitati': (6, 1),
+    'generacodice tutti': (10, 2),
+    'inviacodice 1000': (5, 0),
+    'inviacodice tutti': (6, 1),
+    'aggiungiadmin 1000': (9, 1),
+    'aggiungicapo 1000': (9, 1),
+    'rimuoviadmin 1000': (9, 1),
+    'rimuovicapo 1000': (9, 1),
+    'attiva 1000': (9, 1),
+    'disattiva 1000': (9, 1),
+    'annuncio tutti Riunione giovedì': (6, 1),
+    'statistiche': (6, 1),
+    'cache': (5, 1),
+    'profila': (6, 1),
+    'profila info 2': (6, 1),
+    'getlog': (6, 1),
+    'clearlog': (6, 1),
+    'aggiorna': (22, 2),
+}
+
+# Sent by a Telegram user with no member yet, the others are sent by SUPER_ADMIN
+REGISTRAZIONE = 'registrami nuovo'
+BUDGET_REGISTRAZIONE = (8, 1)
+
+SUPER_ADMIN = 1
+NUOVO_UTENTE = 999999
+
+BRANCHE = ('Branca L/C', 'Branca E/G', 'Branca R/S', 'Adulti')
+
+
+class RispostaTelegram(object):
+    status_code = 200
+    reason = 'OK'
+    content = b'{"ok":true,"result":{}}'
+
+    def json(self):
+        return {'ok': True, 'result': {}}
+
+
+def svuota_cache():
+    views.RISULTATI.clear()
+    snapshot._snapshot.clear()
+    gruppi._gruppi.clear()
+    profili._armati.clear()
+    cache.clear()
+
+
+# The replica test mirror is another connection and cannot see the rows of the test transaction:
+# without routers every query goes to the primary, and one sent to the replica fails the test.
+# Throttling would turn the later commands away.
+@override_settings(THROTTLE_ATTIVO=False, ISCRITTI_SNAPSHOT=True, DATABASE_ROUTERS=[], TELEGRAM_WEBHOOK_SECRET='segreto')
+class BudgetComandiTest(TestCase):
+    """Drives every command through CocaBotView with a stubbed Bot API and counts queries and calls."""
+    update_id = 0
+
+    def setUp(self):
+        self.gruppo = Gruppi.objects.get(slug=settings.DEFAULT_GRUPPO)
+        Iscritti.objects.create(
+            gruppo=self.gruppo, codice_fiscale='SPRDMN80A01A509X', codice_socio='1', nome='Super', cognome='Admin',
+            sesso='M', data_di_nascita=date(1980, 1, 1), indirizzo='Via Roma', civico='1', branca='Adulti',
+            coca=True, livello_foca='CFA', role='SA', telegram='superadmin', telegram_id=f'id{SUPER_ADMIN}',
+        )
+        Iscritti.objects.create(
+            gruppo=self.gruppo, codice_fiscale='NVSCRT90A41A509X', codice_socio='2', nome='Nuova', cognome='Iscritta',
+            sesso='F', data_di_nascita=date(1990, 1, 1), indirizzo='Via Roma', civico='2', branca='Adulti',
+            coca=True, livello_foca='CFM', authcode='nuovo', email='nuova@example.org',
+        )
+        self.chiamate = []
+        patcher = mock.patch('utils.TelegramClient.requests.post', side_effect=self.bot_api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Mail and announcements go out from background threads, only the request thread is measured
+        for coda in (views.MAIL_QUEUE, views.BROADCASTER):
+            patcher = mock.patch.object(coda, 'submit')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bot_api(self, url, data=None, **kwargs):
+        self.chiamate.append((url.rsplit('/', 1)[-1], data))
+        return RispostaTelegram()
+
+    def popola(self, n: int):
+        Iscritti.objects.bulk_create([
+            Iscritti(
+                gruppo=self.gruppo, codice_fiscale=f'CF{i:014d}', codice_socio=str(1000 + i), nome=f'Nome{i}',
+                cognome=f'Cognome{i}', sesso='MF'[i % 2], data_di_nascita=date(1960 + i % 50, 1 + i % 12, 1),
+                indirizzo='Via Roma', civico=str(i), branca=BRANCHE[i % 4], coca=True, livello_foca='CFA',
+                email=f'socio{i}@example.org', authcode=f'auth{i}', telegram=f'socio{i}', telegram_id=f'id{1000 + i}',
+                role='CA',
+            )
+            for i in range(n)
+        ])
+        AppLogs.objects.bulk_create([
+            AppLogs(gruppo=self.gruppo, username=f'socio{i}', command='/help') for i in range(n)
+        ])
+        aggiorna_statistiche(self.gruppo)
+
+    def workbook(self) -> pd.DataFrame:
+        """The census workbook holding the members as they are in the database."""
+        return pd.DataFrame([{
+            'CodiceFiscale': iscritto.codice_fiscale, 'CodiceSocio': iscritto.codice_socio, 'Nome': iscritto.nome,
+            'Cognome': iscritto.cognome, 'Sesso': iscritto.sesso, 'DataDiNascita': str(iscritto.data_di_nascita),
+            'ComuneNascita': iscritto.comune_di_nascita, 'Indirizzo': iscritto.indirizzo, 'Civico': iscritto.civico,
+            'ComuneResidenza': iscritto.comune, 'ProvinciaResidenza': iscritto.provincia, 'Cap': iscritto.cap,
+            'Informativa2a': 'Si', 'Informativa2b': 'Si', 'ConsensoImmagini': 'Si',
+            'LivelloFoCa': iscritto.livello_foca, 'CUN': 'G' if iscritto.coca else '', 'Branca': iscritto.branca,
+            'Cellulare': iscritto.cellulare, 'Email': iscritto.email,
+        } for iscritto in Iscritti.objects.filter(gruppo=self.gruppo).order_by('id')])
+
+    def invia(self, testo: str, utente: int = SUPER_ADMIN) -> tuple:
+        """Posts the command as a Telegram update, returns the queries run and the Bot API methods called."""
+        BudgetComandiTest.update_id += 1
+        update = {
+            'update_id': BudgetComandiTest.update_id,
+            'message': {
+                'message_id': 1,
+                'from': {'id': utente, 'username': f'utente{utente}'},
+                'chat': {'id': utente},
+                'text': f'/{testo}',
+            },
+        }
+        svuota_cache()
+        self.chiamate = []
+        with CaptureQueriesContext(connection) as contesto:
+            response = self.client.post(
+                f'/webhooks/{self.gruppo.slug}/', data=json.dumps(update), content_type='application/json',
+                HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN='segreto'
+            )
+        self.assertEqual(response.status_code, 200)
+        metodi = [metodo for metodo, data in self.chiamate]
+        if 'method' in response.json():
+            # Reply carried by the webhook response
+            metodi.append(response.json()['method'])
+        query = [query['sql'] for query in contesto.captured_queries]
+        return query, metodi
+
+    def misura(self, testo: str, n: int, utente: int = SUPER_ADMIN) -> tuple:
+        """Runs the command against a population of n members and log lines, rolled back afterwards."""
+        with transaction.atomic():
+            self.popola(n)
+            with mock.patch.object(DataLoader, 'loadRemoteToDataframe', return_value=self.workbook()):
+                query, metodi = self.invia(testo, utente)
+            transaction.set_rollback(True)
+        return query, metodi
+
+    def verifica(self, testo: str, budget: tuple, utente: int = SUPER_ADMIN):
+        max_query, max_chiamate = budget
+        conteggi = {}
+        for n in POPOLAZIONI:
+            with self.subTest(comando=testo, righe=n):
+                query, metodi = self.misura(testo, n, utente)
+                conteggi[n] = len(query)
+                self.assertLessEqual(
+                    len(query), max_query,
+                    f'/{testo} con {n} righe: {len(query)} query, budget {max_query}\n' + '\n'.join(query)
+                )
+                self.assertLessEqual(
+                    len(metodi), max_chiamate,
+                    f'/{testo} con {n} righe: {len(metodi)} chiamate Telegram {metodi}'
+                )
+        self.assertEqual(
+            len(set(conteggi.values())), 1,
+            f'/{testo}: le query crescono con le righe restituite {conteggi}'
+        )
+
+    def test_budget_comandi(self):
+        for testo, budget in BUDGET.items():
+            self.verifica(testo, budget)
+
+    def test_budget_registrazione(self):
+        self.verifica(REGISTRAZIONE, BUDGET_REGISTRAZIONE, NUOVO_UTENTE)
+
+    def test_aggiorna_parziale(self):
+        """Loading one branca's workbook leaves the members of the other branche active."""
+        with transaction.atomic():
+            self.popola(10)
+            workbook = self.workbook()
+            lc = workbook[workbook.Branca == 'Branca L/C']
+            Iscritti.objects.filter(codice_fiscale__in=list(lc.CodiceFiscale)).update(
+                active=False, disattivato_da_sync=True
+            )
+            with override_settings(DOCUMENTS_URL='lc.xlsx,eg.xlsx'), \
+                    mock.patch.object(DataLoader, 'loadRemoteToDataframe', return_value=lc):
+                self.invia('aggiorna lc.xlsx')
+            attivi = Iscritti.objects.filter(gruppo=self.gruppo, active=True)
+            self.assertEqual(attivi.count(), Iscritti.objects.filter(gruppo=self.gruppo).count())
+
+            # The same rows as the only configured workbook are the whole register
+            with override_settings(DOCUMENTS_URL='lc.xlsx'), \
+                    mock.patch.object(DataLoader, 'loadRemoteToDataframe', return_value=lc):
+                self.invia('aggiorna')
+            self.assertEqual(sorted(attivi.values_list('codice_fiscale', flat=True)), sorted(lc.CodiceFiscale))
+            transaction.set_rollback(True)
+
+    @override_settings(DOCUMENTS_URL='iscritti.xlsx')
+    def test_disattiva_resiste_alla_sincronizzazione(self):
+        """A full sync turns back on only the members it turned off, not those turned off with /disattiva."""
+        self.popola(4)
+        workbook = self.workbook()
+        self.invia('disattiva 1000')
+        uscito = workbook[workbook.CodiceSocio != '1001']
+        with mock.patch.object(DataLoader, 'loadRemoteToDataframe', return_value=uscito):
+            self.invia('aggiorna')
+        with mock.patch.object(DataLoader, 'loadRemoteToDataframe', return_value=workbook):
+            self.invia('aggiorna')
+        attivi = dict(Iscritti.objects.filter(codice_socio__in=['1000', '1001']).values_list('codice_socio', 'active'))
+        self.assertEqual(attivi, {'1000': False, '1001': True})
+
+    def scaricato(self, workbook: pd.DataFrame, checksum: str):
+        """Stands in for the download of iscritti.xlsx, with the checksum computed while it streams in."""
+        def scarica(loader):
+            loader.checksums = {'iscritti.xlsx': checksum}
+            return workbook
+        return mock.patch.object(DataLoader, 'loadRemoteToDataframe', autospec=True, side_effect=scarica)
+
+    @override_settings(DOCUMENTS_URL='iscritti.xlsx')
+    def test_checksum_salvato(self):
+        """The checksum of each loaded workbook is kept with the register it produced."""
+        self.popola(4)
+        with self.scaricato(self.workbook(), 'a' * 64):
+            self.invia('aggiorna')
+        self.assertEqual(
+            list(Documenti.objects.filter(gruppo=self.gruppo).values_list('nome', 'checksum')),
+            [('iscritti.xlsx', 'a' * 64)]
+        )
+
+    @override_settings(DOCUMENTS_URL='iscritti.xlsx')
+    def test_sincronizzazione_incrementale(self):
+        """The scheduler parses and compares a workbook only when its bytes changed since the last full load."""
+        self.popola(4)
+        contenuto = [b'versione 1']
+
+        def file_remoto(url):
+            remoto = mock.MagicMock()
+            remoto.with_credentials.return_value.download_session.side_effect = \
+                lambda buffer: buffer.write(contenuto[0]) and mock.MagicMock()
+            return remoto
+
+        with mock.patch('utils.DataLoader.File.from_url', side_effect=file_remoto), \
+                mock.patch('utils.DataLoader.parseWorkbook', return_value=self.workbook()) as parse:
+            self.assertNotIn('invariati', scheduler.sincronizza())
+            self.assertIn('File invariati', scheduler.sincronizza())
+            self.assertEqual(parse.call_count, 1)
+            contenuto[0] = b'versione 2'
+            self.assertNotIn('invariati', scheduler.sincronizza())
+            self.assertEqual(parse.call_count, 2)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_inviacodice_tutti(self):
+        """One SMTP connection per batch, a failed send is retried and the report lists every recipient.
+
+        The queue runs for real on the locmem backend, only the Bot API is stubbed.
+        """
+        Iscritti.objects.bulk_create([
+            Iscritti(
+                gruppo=self.gruppo, codice_fiscale=f'MAIL{i:012d}', codice_socio=str(5000 + i), nome=f'Nome{i}',
+                cognome=f'Mail{i}', sesso='F', data_di_nascita=date(1990, 1, 1), indirizzo='Via Roma', civico='1',
+                branca='Adulti', authcode=f'mail{i}', email=f'mail{i}@example.org',
+            )
+            for i in range(3)
+        ])
+        invio = mail.get_connection().__class__.send_messages
+        falliti = []
+
+        def send_messages(backend, messages):
+            # The first attempt for the second member fails, the retry goes through
+            if messages[0].to == ['mail1@example.org'] and not falliti:
+                falliti.append(messages[0].to)
+                raise ConnectionError('connessione persa')
+            return invio(backend, messages)
+
+        coda = views.MAIL_QUEUE
+        with mock.patch.object(coda, 'submit', MailQueue.submit.__get__(coda)), \
+                mock.patch.object(coda, '_retry_delay', 0), \
+                mock.patch('utils.MailQueue.get_connection', wraps=mail.get_connection) as connessioni, \
+                mock.patch('utils.MailQueue.close_old_connections') as chiusure, \
+                mock.patch.object(mail.get_connection().__class__, 'send_messages', send_messages):
+            self.invia('inviacodice tutti')
+            coda.join()
+
+        self.assertEqual(connessioni.call_count, 1)
+        # Before and after the batch, the database connections of the thread are checked
+        self.assertEqual(chiusure.call_count, 2)
+        self.assertEqual(falliti, [['mail1@example.org']])
+        # With the unregistered member of setUp
+        self.assertEqual(sorted(messaggio.to[0] for messaggio in mail.outbox),
+                         [f'mail{i}@example.org' for i in range(3)] + ['nuova@example.org'])
+        resoconto = '\n'.join(data['text'] for metodo, data in self.chiamate if metodo == 'sendMessage')
+        for i in range(3):
+            self.assertIn(f'Nome{i} Mail{i}: inviata', resoconto)
+        self.assertIn('Nuova Iscritta: inviata', resoconto)
+        self.assertIn('*Email inviate:* 4', resoconto)
+
+    def test_risposta_inline_dopo_un_errore(self):
+        """A reply held for the webhook response is sent through the Bot API when the handler fails."""
+        def fallisce(view, request):
+            views.send_message('Ciao\\!', SUPER_ADMIN)
+            raise RuntimeError('errore del comando')
+
+        with mock.patch.object(views.CocaBotView, 'handle_update', fallisce):
+            with self.assertRaises(RuntimeError):
+                self.invia('start')
+        self.assertEqual([metodo for metodo, data in self.chiamate], ['sendMessage'])
+
+    def test_risposta_inline_solo_markdown_valido(self):
+        """A reply Telegram could reject is sent through the Bot API, which reports the error."""
+        def risponde(view, request):
+            views.send_message('Ciao!', SUPER_ADMIN)
+            return views.JsonResponse({"ok": "POST request processed"})
+
+        with mock.patch.object(views.CocaBotView, 'handle_update', risponde):
+            query, metodi = self.invia('start')
+        self.assertEqual([metodo for metodo, data in self.chiamate], ['sendMessage'])
+        self.assertEqual(metodi, ['sendMessage'])
+
+    def test_snapshot_per_codice(self):
+        """The snapshot finds the same members as get_iscritto_by_codice."""
+        self.popola(10)
+        self.addCleanup(gruppi.ripristina_gruppo, gruppi.attiva_gruppo(self.gruppo))
+        for codice in ('1005', 'cf00000000000003', 'SPRDMN80A01A509X', '100', ''):
+            for attivi in (False, True):
+                with self.subTest(codice=codice, attivi=attivi):
+                    self.assertEqual(
+                        [iscritto.id for iscritto in snapshot.snapshot_iscritti().per_codice_socio_o_fiscale(codice, attivi)],
+                        list(views.get_iscritto_by_codice(codice, attivi).order_by('id').values_list('id', flat=True))
+                    )
+
+    @override_settings(ISCRITTI_SNAPSHOT=False)
+    def test_query_costanti_senza_snapshot(self):
+        """Role checks and searches on the database must not run a query per member either."""
+        for testo in BUDGET:
+            conteggi = {n: len(self.misura(testo, n)[0]) for n in POPOLAZIONI}
+            self.assertEqual(
+                len(set(conteggi.values())), 1,
+                f'/{testo}: le query crescono con le righe restituite {conteggi}'
+            )
+
+
+@mock.patch.dict(settings.DATABASES, {REPLICA_DB_ALIAS: {}})
+class ReplicaRouterTest(SimpleTestCase):
+    """Reads of an update go to the replica until the update writes the same model."""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_fuori_da_un_update(self):
+        self.assertEqual(self.router.db_for_read(Iscritti), 'default')
+        self.assertEqual(self.router.db_for_write(Iscritti), 'default')
+
+    def test_letture_dopo_una_scrittura(self):
+        token = inizia_update()
+        try:
+            self.assertEqual(self.router.db_for_read(Iscritti), REPLICA_DB_ALIAS)
+            self.assertEqual(self.router.db_for_write(Iscritti), 'default')
+            self.assertEqual(self.router.db_for_read(Iscritti), 'default')
+            self.assertEqual(self.router.db_for_read(AppLogs), REPLICA_DB_ALIAS)
+        finally:
+            fine_update(token)
+        self.assertEqual(self.router.db_for_read(AppLogs), 'default')
+
+    def test_senza_replica(self):
+        del settings.DATABASES[REPLICA_DB_ALIAS]
+        token = inizia_update()
+        try:
+            self.assertEqual(self.router.db_for_read(Iscritti), 'default')
+        finally:
+            fine_update(token)
+
+    def test_migrazioni_solo_sul_primario(self):
+        self.assertTrue(self.router.allow_migrate('default', 'coca_bot'))
+        self.assertFalse(self.router.allow_migrate(REPLICA_DB_ALIAS, 'coca_bot'))
+
+
+class LettureModificaTest(TestCase):
+    """Reads that decide a write stay on the primary while the update reads from the replica."""
+
+    def test_sincronizzazione_sul_primario(self):
+        gruppo = Gruppi.objects.get(slug=settings.DEFAULT_GRUPPO)
+        loader = DataLoader('', '', '', [], gruppo)
+        attivo = gruppi.attiva_gruppo(gruppo)
+        token = inizia_update()
+        try:
+            with mock.patch.object(ReplicaRouter, 'db_for_read', return_value=REPLICA_DB_ALIAS):
+                loader.loadDbToDataframe()
+                views.get_iscritto_by_codice('1', primario=True).count()
+                views.get_iscritto_by_authcode('nuovo').count()
+                aggiorna_statistiche(gruppo)
+        finally:
+            fine_update(token)
+            gruppi.ripristina_gruppo(attivo)
+
+
+@override_settings(ADMIN_CONTEGGIO_MAX=5)
+class PaginatorConteggioLimitatoTest(TestCase):
+    """The admin change lists never count past the limit."""
+
+    def setUp(self):
+        self.gruppo = Gruppi.objects.get(slug=settings.DEFAULT_GRUPPO)
+
+    def conta(self, n: int) -> int:
+        AppLogs.objects.bulk_create([AppLogs(gruppo=self.gruppo, username=f'socio{i}', command='/help') for i in range(n)])
+        with CaptureQueriesContext(connection) as contesto:
+            conteggio = PaginatorConteggioLimitato(AppLogs.objects.order_by('id'), 2).count
+        self.assertIn('LIMIT 6', contesto.captured_queries[0]['sql'])
+        return conteggio
+
+    def test_sotto_il_limite(self):
+        self.assertEqual(self.conta(3), 3)
+
+    def test_oltre_il_limite(self):
+        self.assertEqual(self.conta(20), 5)
+
+
+class SincronizzazioneTest(TestCase):
+    """The scheduler sync goes on past a failing group and stops once the lease is lost."""
+
+    def setUp(self):
+        Gruppi.objects.create(slug='secondo', nome='Secondo gruppo')
+
+    def test_errore_di_un_gruppo(self):
+        with mock.patch.object(DataLoader, 'loadRemoteIntoDb', side_effect=Exception('file mancante')) as sync:
+            esecuzione = scheduler.esegui('sync', scheduler.sincronizza, 'test')
+        self.assertEqual(sync.call_count, Gruppi.objects.filter(active=True).count())
+        self.assertEqual(esecuzione.esito, 'errore')
+        self.assertIn('secondo: errore', esecuzione.dettaglio)
+
+    def test_lease_perso(self):
+        with mock.patch.object(DataLoader, 'loadRemoteIntoDb') as sync:
+            esecuzione = scheduler.esegui('sync', scheduler.sincronizza, 'test', lambda: False)
+        sync.assert_not_called()
+        self.assertEqual(esecuzione.esito, 'errore')
+        self.assertIn('Lease dello scheduler perso', esecuzione.dettaglio)
+
+
+@override_settings(ANNUNCI_MESSAGES_PER_SECOND=1000)
+class TelegramNonDisponibileTest(TestCase):
+    """During a Telegram outage announcements stop where they are and notices are kept for reinvia."""
+
+    def setUp(self):
+        self.gruppo = Gruppi.objects.get(slug=settings.DEFAULT_GRUPPO)
+        for i in range(3):
+            Iscritti.objects.create(
+                gruppo=self.gruppo, codice_fiscale=f'CF{i:014d}', codice_socio=str(1000 + i), nome=f'Nome{i}',
+                cognome=f'Cognome{i}', sesso='M', data_di_nascita=date(1980, 1, 1), indirizzo='Via Roma', civico='1',
+                branca='Adulti', role='SA' if i == 0 else 'CA', telegram_id=f'id{1000 + i}',
+            )
+        # A breaker of its own, the failures must not open the one of the other tests
+        patcher = mock.patch.dict(TelegramClient._breakers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def annuncia(self, risposte: list) -> Annunci:
+        annuncio = Annunci.objects.create(gruppo=self.gruppo, autore='admin', chat_id='1', testo='Riunione')
+        annuncio = Annunci.objects.select_related('gruppo').get(id=annuncio.id)
+        broadcaster = Broadcaster(settings.ANNUNCI_MESSAGES_PER_SECOND)
+        with mock.patch('utils.TelegramClient.requests.post', side_effect=risposte):
+            self.assertTrue(broadcaster.claim(annuncio))
+            broadcaster.broadcast(annuncio)
+        return Annunci.objects.get(id=annuncio.id)
+
+    def test_annuncio_interrotto(self):
+        annuncio = self.annuncia([RispostaTelegram(), requests.ConnectionError('down')])
+        self.assertFalse(annuncio.completato)
+        self.assertEqual((annuncio.consegnati, annuncio.falliti), (1, 0))
+        self.assertEqual(annuncio.ultimo_iscritto, Iscritti.objects.order_by('id').values_list('id', flat=True)[0])
+
+    def test_resoconto_salvato(self):
+        annuncio = self.annuncia([RispostaTelegram()] * 3 + [requests.ConnectionError('down')])
+        self.assertTrue(annuncio.completato)
+        self.assertEqual(MessaggiNonConsegnati.objects.filter(gruppo=self.gruppo, metodo='sendMessage').count(), 1)
+
+    def test_profilo_non_inviato(self):
+        """The profile stays stored and a notice is kept, the command and its own error are untouched."""
+        profilazione = Profilazioni.objects.create(gruppo=self.gruppo, comando='info', chat_id='1', rimanenti=0)
+        with mock.patch('utils.TelegramClient.requests.post', side_effect=requests.ConnectionError('down')):
+            with profili.profila('info', profilazione, self.gruppo):
+                sum(range(1000))
+            with self.assertRaisesMessage(ValueError, 'errore del comando'):
+                with profili.profila('info', profilazione, self.gruppo):
+                    raise ValueError('errore del comando')
+        self.assertEqual(Profili.objects.filter(gruppo=self.gruppo).count(), 2)
+        self.assertEqual(MessaggiNonConsegnati.objects.filter(gruppo=self.gruppo).count(), 2)
+
+    def test_notifica_admin_salvata(self):
+        with mock.patch('utils.TelegramClient.requests.post', side_effect=requests.ConnectionError('down')):
+            self.gruppo.notifica_admin('Aggiornamento iscritti completato')
+        self.assertEqual(MessaggiNonConsegnati.objects.filter(gruppo=self.gruppo).count(), 1)
+
+
+class SecretTokenTest(TestCase):
+    """Webhook updates need the secret of the group, outside DEBUG even when none is configured."""
+    update = json.dumps({'update_id': 1, 'poll': {}})
+
+    def setUp(self):
+        gruppi._gruppi.clear()
+        self.addCleanup(gruppi._gruppi.clear)
+
+    def invia(self, **header) -> int:
+        return self.client.post(
+            f'/webhooks/{settings.DEFAULT_GRUPPO}/', data=self.update, content_type='application/json', **header
+        ).status_code
+
+    @override_settings(TELEGRAM_WEBHOOK_SECRET='segreto')
+    def test_secret(self):
+        self.assertEqual(self.invia(HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN='segreto'), 200)
+        self.assertEqual(self.invia(HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN='sbagliato'), 403)
+        self.assertEqual(self.invia(), 403)
+
+    @override_settings(TELEGRAM_WEBHOOK_SECRET='')
+    def test_senza_secret(self):
+        self.assertEqual(self.invia(), 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.invia(), 200)
+
+
+class ChiaviApiTest(TestCase):
+    """API keys are stored as their SHA-256 and checked by hash."""
+
+    def setUp(self):
+        self.gruppo = Gruppi.objects.get(slug=settings.DEFAULT_GRUPPO)
+        self.chiave_api = ChiaviApi(gruppo=self.gruppo, nome='sito')
+        self.chiave = self.chiave_api.genera()
+        self.chiave_api.save()
+
+    def stato(self, token: str) -> int:
+        return self.client.get(f'/api/{self.gruppo.slug}/iscritti/', HTTP_AUTHORIZATION=f'Bearer {token}').status_code
+
+    def test_solo_impronta(self):
+        self.assertNotIn(self.chiave, ChiaviApi.objects.values_list('impronta', flat=True))
+        self.assertEqual(self.stato(self.chiave), 200)
+        self.assertEqual(self.stato(self.chiave_api.impronta), 401)
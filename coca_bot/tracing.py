@@ -0,0 +1,12 @@
+from django.conf import settings
+
+from utils.Tracer import Tracer
+
+# Shared by the webhook, the management commands and the loaders
+TRACER = Tracer(
+    settings.TRACING_SAMPLE_RATE,
+    settings.TRACING_FILE,
+    settings.TRACING_OTLP_ENDPOINT,
+    settings.TRACING_FILE_MAX_BYTES,
+    settings.TRACING_FILE_BACKUPS,
+)
@@ -1,33 +1,99 @@
-import json
+import contextvars
 import os
 import re
 import sys
+import threading
 import traceback
 
-import requests
-from django.http import JsonResponse
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.views import View
 from shlex import split
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
 from django.db.models import Q, QuerySet
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from django.utils import timezone
 from datetime import datetime
 from datetime import timedelta
 
-from coca_bot.models import Iscritti, AppLogs
+from coca_bot.gruppi import attiva_gruppo, get_gruppo, gruppo_corrente, ripristina_gruppo
+from coca_bot.limiti import consuma_gettoni, costo_comando, ruolo_utente
+from coca_bot.models import Iscritti, AppLogs, Annunci, Gruppi, Profilazioni, Profili, Statistiche
+from coca_bot.profili import invia_profilo, profila, profilazione_per
+from coca_bot.recapiti import invia_o_salva
+from coca_bot.routers import fine_update, inizia_update
+from coca_bot.snapshot import aggiorna_versione, snapshot_iscritti
+from coca_bot.statistiche import DIMENSIONI
+from coca_bot.tracing import TRACER
 import secrets
 
+from utils.Broadcaster import Broadcaster
 from utils.DataLoader import DataLoader
+from utils.MailQueue import MailQueue
+from utils.ResultCache import ResultCache
 
-TELEGRAM_URL = "https://api.telegram.org/bot"
-TUTORIAL_BOT_TOKEN = os.getenv("TUTORIAL_BOT_TOKEN", "error_token")
+try:
+    # Optional, decodes updates several times faster than the standard library
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+MESSAGGIO_ERRORE = 'Si è verificato un errore sul server\! Riprova più tardi'
 ISDEBUG = os.getenv("ISDEBUG", "False") == "True"
 FORCEANSWER = os.getenv("FORCEANSWER", "False") == "True"
 
+# Telegram sends update_id first, then the single key naming the type of the update
+UPDATE_TYPE = re.compile(rb'\s*\{\s*"update_id"\s*:\s*\d+\s*,\s*"([a-z_]+)"')
+
+# Only reply of the update, returned as the webhook response instead of calling sendMessage
+_risposta_inline = contextvars.ContextVar('risposta_inline', default=None)
+
+# An escape, or a character MarkdownV2 rejects when it is not escaped
+MARKDOWN_RISERVATI = re.compile(r'\\.|([#+\-={}.!])', re.DOTALL)
+
+# Fields loaded by each command, so listings only transfer what they render
+PROFILI_CAMPI = {
+    'info': ('id', 'codice_socio', 'codice_fiscale', 'nome', 'cognome', 'sesso', 'data_di_nascita',
+             'comune_di_nascita', 'indirizzo', 'civico', 'comune', 'provincia', 'cap', 'informativa2a',
+             'informativa2b', 'consenso_immagini', 'branca', 'cellulare', 'email', 'livello_foca', 'role',
+             'telegram', 'telegram_id', 'authcode', 'active'),
+    'codice': ('codice_socio', 'nome', 'cognome', 'branca'),
+    'abilitati': ('telegram', 'telegram_id', 'nome', 'cognome'),
+    'generacodice': ('id', 'nome', 'cognome', 'authcode'),
+    'mail': ('id', 'nome', 'cognome', 'sesso', 'email', 'authcode'),
+}
+
+# Names accepted by the commands working on a whole branca
+BRANCHE = {
+    'lc': 'Branca L/C',
+    'l/c': 'Branca L/C',
+    'eg': 'Branca E/G',
+    'e/g': 'Branca E/G',
+    'rs': 'Branca R/S',
+    'r/s': 'Branca R/S',
+    'adulti': 'Adulti',
+    'coca': 'Adulti',
+}
+
+MAIL_QUEUE = MailQueue(settings.MAIL_QUEUE_RETRIES, settings.MAIL_QUEUE_RETRY_DELAY)
+BROADCASTER = Broadcaster(settings.ANNUNCI_MESSAGES_PER_SECOND)
+# Rendered replies of /info and /codicesocio, per process
+RISULTATI = ResultCache(settings.RISULTATI_CACHE_MAX, settings.RISULTATI_CACHE_SECONDS)
+
+
+def get_iscritti_gruppo() -> QuerySet:
+    return Iscritti.objects.filter(gruppo=gruppo_corrente())
+
 
-# https://api.telegram.org/bot<token>/setWebhook?url=<url>/webhooks/tutorial/
+def get_logs_gruppo() -> QuerySet:
+    return AppLogs.objects.filter(gruppo=gruppo_corrente())
+
+
+# python manage.py imposta_webhook <url> calls
+# https://api.telegram.org/bot<token>/setWebhook?url=<url>/webhooks/<slug del gruppo>/&secret_token=<webhook_secret>
 def get_iscritti(search_string: str, show_only_active: bool = False, show_all: bool = False) -> QuerySet:
-    iscritti_set = Iscritti.objects.filter(
+    iscritti_set = get_iscritti_gruppo().filter(
         Q(cognome__icontains=search_string) |
         Q(nome__icontains=search_string) |
         Q(codice_socio__icontains=search_string) |
@@ -35,37 +101,77 @@ def get_iscritti(search_string: str, show_only_active: bool = False, show_all: b
         Q(branca__icontains=search_string)
     )
     if show_all:
-        iscritti_set = Iscritti.objects.all()
+        iscritti_set = get_iscritti_gruppo()
     if show_only_active:
         printdebug(f"Show only active - func: {show_only_active}")
-        iscritti_set.filter(
+        iscritti_set = iscritti_set.filter(
             Q(active=True)
         )
     return iscritti_set
 
 
-def get_iscritto_by_codice(search_string: str, show_only_active: bool = False) -> QuerySet:
-    iscritti_set = Iscritti.objects.filter(
+def get_iscritto_by_codice(search_string: str, show_only_active: bool = False, primario: bool = False) -> QuerySet:
+    # A member read to be modified and saved comes from the primary, never from a lagging replica
+    iscritti_set = get_iscritti_gruppo().using(DEFAULT_DB_ALIAS) if primario else get_iscritti_gruppo()
+    iscritti_set = iscritti_set.filter(
         Q(codice_socio__iexact=search_string) |
         Q(codice_fiscale__iexact=search_string)
     )
     if show_only_active:
         printdebug(f"Show only active - func: {show_only_active}")
-        iscritti_set.filter(
+        iscritti_set = iscritti_set.filter(
             Q(active=True)
         )
     return iscritti_set
 
 
+def stream(iscritti_set: QuerySet, profilo: str, as_values: bool = False):
+    """Iterates over the queryset in chunks loading only the fields of the given profile.
+
+    On PostgreSQL the iterator uses a server-side cursor, so memory stays constant
+    whatever the size of the result set.
+    """
+    campi = PROFILI_CAMPI[profilo]
+    if as_values:
+        iscritti_set = iscritti_set.values(*campi)
+    else:
+        iscritti_set = iscritti_set.only(*campi)
+    return iscritti_set.iterator(chunk_size=settings.QUERY_CHUNK_SIZE)
+
+
+def cerca_iscritti(search_string: str, show_only_active: bool, show_all: bool, profilo: str):
+    """Members matched by get_iscritti, served from the in-process snapshot when it is enabled."""
+    if settings.ISCRITTI_SNAPSHOT:
+        return snapshot_iscritti().cerca(search_string, show_only_active=show_only_active, show_all=show_all)
+    return stream(get_iscritti(search_string, show_only_active=show_only_active, show_all=show_all), profilo)
+
+
+def cerca_iscritto_per_codice(search_string: str, show_only_active: bool = False) -> list:
+    """Members matched by get_iscritto_by_codice, read only, from the in-process snapshot when it is enabled."""
+    if settings.ISCRITTI_SNAPSHOT:
+        return snapshot_iscritti().per_codice_socio_o_fiscale(search_string, show_only_active=show_only_active)
+    return list(get_iscritto_by_codice(search_string, show_only_active=show_only_active))
+
+
+def chiave_risultati(comando: str, search_string: str, show_only_active: bool, show_all: bool, visibilita: str) -> tuple:
+    """Key of the rendered replies of a search, the member version makes every write invalidate it."""
+    gruppo = gruppo_corrente()
+    if settings.ISCRITTI_SNAPSHOT:
+        versione = snapshot_iscritti().versione
+    else:
+        versione = Gruppi.objects.using(DEFAULT_DB_ALIAS).values_list('versione_iscritti', flat=True).get(id=gruppo.id)
+    return (gruppo.id, versione, comando, '*' if show_all else search_string.strip().lower(), show_only_active, visibilita)
+
+
 def get_iscritto_by_telegram(t_user: str) -> QuerySet:
     printdebug(t_user)
-    return Iscritti.objects.filter(
+    return get_iscritti_gruppo().filter(
         (Q(telegram_id__iexact=t_user) | Q(telegram__iexact=t_user))
     )
 
 
 def get_enabled() -> QuerySet:
-    return Iscritti.objects.filter(
+    return get_iscritti_gruppo().filter(
         Q(telegram_id__isnull=False)
     ).exclude(
         Q(telegram_id__iexact='') &
@@ -74,26 +180,27 @@ def get_enabled() -> QuerySet:
 
 
 def get_iscritto_by_authcode(authcode: str) -> QuerySet:
-    return Iscritti.objects.filter(
+    # Only read to be registered and saved
+    return get_iscritti_gruppo().using(DEFAULT_DB_ALIAS).filter(
         Q(authcode__iexact=authcode)
     )
 
 
 def get_logs_by_date(days: int) -> QuerySet:
     date_to = datetime.now() - timedelta(days=7)
-    return AppLogs.objects.filter(log_time__date__gte=date_to)
+    return get_logs_gruppo().filter(log_time__date__gte=date_to)
 
 
 def get_logs_by_date_gte(days: int) -> QuerySet:
     date_to = datetime.now() - timedelta(days=7)
-    return AppLogs.objects.filter(
+    return get_logs_gruppo().filter(
         Q(log_time__date__gte=date_to)
     ).order_by('log_time')[:20]
 
 
 def get_logs_by_date_lt(days: int) -> QuerySet:
     date_to = datetime.now() - timedelta(days=7)
-    return AppLogs.objects.filter(
+    return get_logs_gruppo().filter(
         Q(log_time__date__lt=date_to)
     )
 
@@ -107,21 +214,55 @@ def clean_message(string: str) -> str:
     return cleaner.sub(r"\\\1", string)
 
 
+def markdown_valido(message: str) -> bool:
+    """Whether every reserved character outside the markup is escaped, the checks Telegram would fail the message on."""
+    return not any(match.group(1) for match in MARKDOWN_RISERVATI.finditer(message))
+
+
 def send_message(message, chat_id):
-    data = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "MarkdownV2",
-    }
-    response = requests.post(
-        f"{TELEGRAM_URL}{TUTORIAL_BOT_TOKEN}/sendMessage", data=data
-    )
+    risposta = _risposta_inline.get()
+    # Background queues run in a copy of the update context, they always send on their own
+    if risposta is not None and risposta['thread'] == threading.get_ident():
+        # Telegram reports no error for a reply in the webhook response, one it could reject
+        # goes through send_message_now and its fallback
+        if not risposta['usata'] and markdown_valido(message):
+            risposta['usata'] = True
+            risposta['messaggio'] = (message, chat_id)
+            return
+        if risposta['messaggio'] is not None:
+            # A second reply, send the first one now to keep them in order
+            send_message_now(*risposta['messaggio'])
+            risposta['messaggio'] = None
+    send_message_now(message, chat_id)
+
+
+def send_message_now(message, chat_id):
+    dati = {"chat_id": chat_id, "text": message, "parse_mode": "MarkdownV2"}
+    with TRACER.span('telegram.sendMessage', length=len(message)):
+        # Telegram is down or the breaker is open: kept for reinvia_messaggi instead of waiting
+        response = invia_o_salva(gruppo_corrente(), 'sendMessage', dati)
+    if response is None:
+        return
     if(response.status_code != 200):
         print(response.status_code)
         print(response.reason)
         print(response.content)
         print(message)
-        send_message("Si è verificato un errore sul server\! Riprova più tardi", chat_id)
+        # Only once, the error message itself must not fail into another one
+        if message != MESSAGGIO_ERRORE:
+            send_message(MESSAGGIO_ERRORE, chat_id)
+
+
+def send_packed_messages(lines: list, chat_id):
+    """Sends the lines packing as many as fit in each Telegram message."""
+    message = ''
+    for line in lines:
+        if message and len(message) + len(line) + 1 > TELEGRAM_MAX_MESSAGE_LENGTH:
+            send_message(message, chat_id)
+            message = ''
+        message += f'{line}\n'
+    if message:
+        send_message(message, chat_id)
 
 
 def printdebug(string:any):
@@ -133,16 +274,121 @@ def print_mail_field(email:str) -> str:
     return ' \- ' if email is None else f"{clean_message(email)}"
 
 
+def tipo_update(body: bytes):
+    """Type of the update read from the raw body, None when the keys are not in the usual order."""
+    match = UPDATE_TYPE.match(body)
+    return match.group(1).decode() if match else None
+
+
+def registra_update(username: str, command: str, update_id) -> bool:
+    """Logs the update, returns False when Telegram is retrying one already handled."""
+    applog = AppLogs(
+        gruppo=gruppo_corrente(),
+        username=username,
+        command=command,
+        update_id=update_id
+    )
+
+    try:
+        applog.save()
+    except IntegrityError:
+        printdebug(f"Update {applog.update_id} already processed")
+        return False
+    return True
+
+
 def get_telegram_link(iscritto: Iscritti):
     return f"[@{iscritto.telegram}](tg://user?id={iscritto.telegram_id[2:]})"
 
 
 class CocaBotView(View):
+    # Handler of each update type, the others are acknowledged without decoding them
+    HANDLERS = {
+        'message': 'handle_message',
+        'edited_message': 'handle_edited_message',
+        'callback_query': 'handle_callback_query',
+        'my_chat_member': 'handle_my_chat_member',
+    }
+
     def post(self, request, *args, **kwargs):
+        tipo = tipo_update(request.body)
+        if tipo is not None and tipo not in self.HANDLERS:
+            # Channel posts, inline queries, polls...: nothing to do, and no retries
+            return JsonResponse({"ok": "POST request processed"})
+        gruppo = get_gruppo(kwargs.get('gruppo', settings.DEFAULT_GRUPPO))
+        if gruppo is None:
+            raise Http404("Gruppo sconosciuto")
+        token = attiva_gruppo(gruppo)
+        update_token = inizia_update()
+        risposta = {'thread': threading.get_ident(), 'usata': not settings.WEBHOOK_REPLY_INLINE, 'messaggio': None}
+        risposta_token = _risposta_inline.set(risposta)
+        try:
+            with TRACER.trace('webhook', gruppo=gruppo.slug):
+                response = self.handle_update(request)
+                TRACER.annotate(inline=risposta['messaggio'] is not None)
+        except Exception:
+            # Only a handler that finished replies inline, the held message still reaches the user
+            if risposta['messaggio'] is not None:
+                messaggio, risposta['messaggio'] = risposta['messaggio'], None
+                send_message_now(*messaggio)
+            raise
+        finally:
+            messaggio = risposta['messaggio']
+            risposta['usata'] = True
+            risposta['messaggio'] = None
+            _risposta_inline.reset(risposta_token)
+            fine_update(update_token)
+            ripristina_gruppo(token)
+
+        if messaggio is not None:
+            # Telegram runs the method in the webhook response, saving the outbound call
+            message, chat_id = messaggio
+            return JsonResponse({
+                "method": "sendMessage",
+                "chat_id": chat_id,
+                "text": message,
+                "parse_mode": "MarkdownV2",
+            })
+        return response
+
+    def handle_update(self, request):
+        try:
+            t_data = json_loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("Update non valido")
+        tipo = next((chiave for chiave in t_data if chiave != 'update_id'), None)
+        TRACER.annotate(update=tipo)
+        handler = self.HANDLERS.get(tipo)
+        if handler is None:
+            return JsonResponse({"ok": "POST request processed"})
+        return getattr(self, handler)(t_data)
+
+    def handle_edited_message(self, t_data: dict) -> JsonResponse:
+        # Editing a command does not run it again
+        return JsonResponse({"ok": "POST request processed"})
 
-        t_data = json.loads(request.body)
+    def handle_callback_query(self, t_data: dict) -> JsonResponse:
+        # No inline keyboards yet, answering stops the loading indicator on the button
+        return JsonResponse({
+            "method": "answerCallbackQuery",
+            "callback_query_id": t_data["callback_query"]["id"],
+        })
+
+    def handle_my_chat_member(self, t_data: dict) -> JsonResponse:
+        t_member = t_data["my_chat_member"]
+        t_from = t_member.get("from", {})
+        # The user blocked or restarted the bot, kept in the logs
+        registra_update(
+            t_from.get("username") or f"userid{t_from.get('id')}",
+            f'my_chat_member {t_member.get("new_chat_member", {}).get("status")}',
+            t_data.get("update_id"),
+        )
+        return JsonResponse({"ok": "POST request processed"})
+
+    def handle_message(self, t_data: dict) -> JsonResponse:
         t_message = t_data["message"]
         t_chat = t_message["chat"]
+        t_from = t_message.get("from", {})
         if FORCEANSWER:
             print("Answer forced")
             print(t_data)
@@ -155,13 +401,13 @@ class CocaBotView(View):
 
             return JsonResponse({"ok": "POST request processed"})
 
-        if 'id' in t_message['from'].keys():
-            t_user = "id"+str(t_message['from']['id'])
+        if 'id' in t_from.keys():
+            t_user = "id"+str(t_from['id'])
         else:
             t_user = None
 
-        if 'username' in t_message['from'].keys():
-            t_user_name = t_message['from']['username']
+        if 'username' in t_from.keys():
+            t_user_name = t_from['username']
         else:
             t_user_name = f"user{t_user}"
 
@@ -175,21 +421,38 @@ class CocaBotView(View):
             return JsonResponse({"ok": "POST request processed"})
         printdebug(text)
 
-        applog = AppLogs(
-            username=t_user_name,
-            command=text
-        )
-
-        applog.save()
+        if not registra_update(t_user_name, text, t_data.get("update_id")):
+            return JsonResponse({"ok": "POST request processed"})
 
         text = text.lstrip("/")
-        s = split(text, posix=True)
+        try:
+            s = split(text, posix=True)
+        except ValueError:
+            # Unbalanced quotes, as in an apostrophe inside an announcement
+            s = text.split()
+        TRACER.annotate(command=s[0] if s else '')
+
+        costo = costo_comando(s)
+        if settings.THROTTLE_ATTIVO and costo > 0:
+            attesa, avvisa = consuma_gettoni(gruppo_corrente(), t_user or t_user_name, ruolo_utente(t_user), costo)
+            if attesa > 0:
+                TRACER.annotate(throttled=attesa)
+                if avvisa:
+                    send_message(f'Stai usando il bot troppo velocemente, riprova tra {attesa} secondi', t_chat["id"])
+                return JsonResponse({"ok": "POST request processed"})
+
+        profilazione = profilazione_per(s[0]) if s else None
+        if profilazione is None:
+            return self.dispatch_command(s, t_message, t_chat, t_user, t_user_name)
+        with profila(s[0], profilazione):
+            return self.dispatch_command(s, t_message, t_chat, t_user, t_user_name)
 
+    def dispatch_command(self, s: list, t_message: dict, t_chat: dict, t_user: str, t_user_name: str) -> JsonResponse:
         try:
 
             if s[0] == 'start':
                 send_message(
-                    'Benvenuto sul bot della *Comunità Capi AGESCI Avellino 1*\\n',
+                    f'Benvenuto sul bot della *Comunità Capi AGESCI {clean_message(gruppo_corrente().nome)}*\\n',
                     t_chat["id"],
                 )
 
@@ -207,6 +470,8 @@ class CocaBotView(View):
                 if len(s) < 2:
                     send_message("Non mi hai detto a chi devo mandare il codice\!", t_chat["id"])
                     return JsonResponse({"ok": "POST request processed"})
+                if (s[1] == 'tutti') | (s[1] in BRANCHE):
+                    return self.invia_codici_per_mail(s, t_user, t_chat)
                 return self.invia_codice_per_mail(s[1], t_chat['id'])
 
             if s[0] == 'aggiungiadmin':
@@ -222,6 +487,8 @@ class CocaBotView(View):
                 return self.rimuovi_coca(s, t_user, t_chat)
 
             if s[0] == 'aggiorna':
+                # Document paths keep their original casing
+                s = t_message["text"].strip().lstrip("/").split()
                 return self.aggiorna_lista(s, t_user, t_chat)
 
             if s[0] == 'help':
@@ -251,13 +518,25 @@ class CocaBotView(View):
             if s[0] == 'abilitati':
                 return self.abilitati(s, t_user, t_chat)
 
+            if s[0] == 'annuncio':
+                return self.annuncio(s, t_user, t_chat, t_user_name, t_message["text"])
+
+            if s[0] == 'statistiche':
+                return self.statistiche(t_user, t_chat)
+
+            if s[0] == 'cache':
+                return self.statistiche_cache(t_user, t_chat)
+
+            if s[0] == 'profila':
+                return self.richiedi_profilo(s, t_user, t_chat, t_user_name)
+
             if s[0] == 'getlog':
                 return self.get_log(s, t_user, t_chat)
 
             if s[0] == 'clearlog':
                 return self.clear_log(s, t_user, t_chat)
         except Exception as e:
-            send_message("Si è verificato un errore sul server\! Riprova più tardi")
+            send_message(MESSAGGIO_ERRORE, t_chat["id"])
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             printdebug(f'{exc_type}, {fname}, {exc_tb.tb_lineno}')
@@ -283,7 +562,7 @@ class CocaBotView(View):
             send_message("Il codice di autorizzazione inviato non è valido\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
 
-        iscritto_set = get_iscritto_by_telegram(t_user)
+        iscritto_set = get_iscritto_by_telegram(t_user).using(DEFAULT_DB_ALIAS)
         if iscritto_set.count() > 0:
             iscritto = iscritto_set[0]
             send_message(f'Questo nick telegram è già registrato per {clean_message(iscritto.nome)} {clean_message(iscritto.cognome)}', t_chat["id"])
@@ -320,26 +599,31 @@ class CocaBotView(View):
         show_only_active = (s[2] == 'attivi') if len(s) >= 3 else True
         printdebug(f"Show only active: {show_only_active}")
 
-        iscritti_set = get_iscritti(search_string, show_only_active=show_only_active, show_all=show_all)
-
         message_text = ''
         counter = 0
 
-        for iscritto in iscritti_set:
-            if (not show_only_active) | iscritto.active:
+        chiave = chiave_risultati('codice', search_string, show_only_active, show_all, 'CA')
+        messaggi = RISULTATI.get(chiave)
+        if messaggi is None:
+            messaggi = []
+            for iscritto in cerca_iscritti(search_string, show_only_active, show_all, 'codice'):
                 counter += 1
                 iscritto_text = f'*Codice Socio:* {clean_message(str(iscritto.codice_socio))}\n' \
                                 f'*Nome:* {clean_message(iscritto.nome)} {clean_message(iscritto.cognome)}\n' \
                                 f'*Branca:* {clean_message(iscritto.branca)}\n'
                 iscritto_text += '\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\n'
 
-                send_message(iscritto_text, t_chat["id"])
+                messaggi.append(iscritto_text)
 
-        if counter < 1:
-            message_text = 'Nessun iscritto con i criteri di ricerca specificati'
-        else:
-            message_text = f"*Soci trovati:* {counter}"
-        send_message(message_text, t_chat["id"])
+            if counter < 1:
+                message_text = 'Nessun iscritto con i criteri di ricerca specificati'
+            else:
+                message_text = f"*Soci trovati:* {counter}"
+            messaggi.append(message_text)
+            RISULTATI.set(chiave, messaggi)
+
+        # Packed, one message per member would be one Bot API call per row
+        send_packed_messages([message_text.rstrip('\n') for message_text in messaggi], t_chat["id"])
         return JsonResponse({"ok": "POST request processed"})
 
     def get_info(self, s, t_user, t_chat):
@@ -358,20 +642,18 @@ class CocaBotView(View):
             show_only_active = (s[2] == 'attivi') if len(s) >= 3 else True
             printdebug(f"Show only active: {show_only_active}")
 
-            iscritti_set = get_iscritti(search_string, show_only_active=show_only_active, show_all=show_all)
-
             # message_text = ''
-            if iscritti_set.count() < 1:
-                message_text = 'Nessun iscritto con i criteri di ricerca specificati'
-                send_message(message_text, t_chat["id"])
-                return JsonResponse({"ok": "POST request processed"})
-
             counter = 0
+            is_admin = self.check_admin(t_user, t_chat['id'], False)
+
+            chiave = chiave_risultati('info', search_string, show_only_active, show_all, 'AD' if is_admin else 'CA')
+            messaggi = RISULTATI.get(chiave)
 
             try:
-                for iscritto in iscritti_set:
-                    if (not show_only_active) | iscritto.active:
-                        counter+=1
+                if messaggi is None:
+                    messaggi = []
+                    for iscritto in cerca_iscritti(search_string, show_only_active, show_all, 'info'):
+                        counter += 1
                         printdebug(f'*Nome:* {iscritto.nome} {iscritto.cognome}')
                         iscritto_text = ''
                         iscritto_text += f'*Codice Socio:* {clean_message(str(iscritto.codice_socio))}\n' \
@@ -386,7 +668,7 @@ class CocaBotView(View):
                                         f'*Email:* {print_mail_field(iscritto.email)}\n' \
                                         f'*Fo\.Ca\.:* {clean_message(iscritto.livello_foca)}\n'
                         # print(iscritto_text)
-                        if self.check_admin(t_user, t_chat['id'], False):
+                        if is_admin:
                             iscritto_text += f'*Ruolo:* {clean_message(iscritto.get_role_display())}\n'
                             iscritto_text += f'*Telegram:* {"" if iscritto.telegram_id is None else get_telegram_link(iscritto)}\n'
                             iscritto_text += f'*AuthCode:* {parse_none_string(iscritto.authcode)}\n'
@@ -396,12 +678,15 @@ class CocaBotView(View):
                         iscritto_text += '\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\-\\n'
 
                         printdebug(iscritto_text)
-                        send_message(iscritto_text, t_chat["id"])
-                if counter < 1:
-                    message_text = 'Nessun iscritto con i criteri di ricerca specificati'
-                else:
-                    message_text = f"*Soci trovati:* {counter}"
-                send_message(message_text, t_chat["id"])
+                        messaggi.append(iscritto_text)
+                    if counter < 1:
+                        message_text = 'Nessun iscritto con i criteri di ricerca specificati'
+                    else:
+                        message_text = f"*Soci trovati:* {counter}"
+                    messaggi.append(message_text)
+                    RISULTATI.set(chiave, messaggi)
+
+                send_packed_messages([message_text.rstrip('\n') for message_text in messaggi], t_chat["id"])
                 return JsonResponse({"ok": "POST request processed"})
             except Exception as e:
                 printdebug(e)
@@ -421,11 +706,11 @@ class CocaBotView(View):
         if self.check_admin(t_user, t_chat["id"]):
             iscritti_set = get_enabled()
             text = ''.join(
-                f"[@{iscritto.telegram}](tg://user?id={iscritto.telegram_id[2:]}): {clean_message(iscritto.nome)} {clean_message(iscritto.cognome)}\n"
-                for iscritto in iscritti_set
+                f"[@{iscritto['telegram']}](tg://user?id={iscritto['telegram_id'][2:]}): {clean_message(iscritto['nome'])} {clean_message(iscritto['cognome'])}\n"
+                for iscritto in stream(iscritti_set, 'abilitati', as_values=True)
             )
 
-            if iscritti_set.count() < 1:
+            if text == '':
                 text = 'Non trovo iscritti abilitati'
             send_message(text, t_chat['id'])
 
@@ -435,7 +720,7 @@ class CocaBotView(View):
         if self.check_admin(t_user, t_chat["id"]):
             if len(s) > 1:
                 if s[1] == 'tutti':
-                    iscritti = Iscritti.objects.filter(
+                    iscritti = get_iscritti_gruppo().filter(
                         Q(coca=True)
                     )
                 else:
@@ -443,19 +728,26 @@ class CocaBotView(View):
                         Q(coca=True)
                     )
             else:
-                iscritti = Iscritti.objects.filter(
+                iscritti = get_iscritti_gruppo().filter(
                     Q(coca=True) &
                     Q(authcode__isnull=True)
                 )
 
-            for iscritto in iscritti:
-                authcode = secrets.token_urlsafe(6)
-                iscritto.authcode = authcode
-                iscritto.save(force_update=True)
-                send_message(f'Authcode per {clean_message(iscritto.nome)} {clean_message(iscritto.cognome)}: *{clean_message(iscritto.authcode)}*',
-                                  t_chat["id"])
-
-            send_message(f'Aggiornati *{iscritti.count()}* authcode', t_chat["id"])
+            with transaction.atomic():
+                iscritti = list(iscritti.select_for_update().only(*PROFILI_CAMPI['generacodice']))
+                authcodes = set()
+                while len(authcodes) < len(iscritti):
+                    authcodes.add(secrets.token_urlsafe(6))
+                for iscritto, authcode in zip(iscritti, authcodes):
+                    iscritto.authcode = authcode
+                Iscritti.objects.bulk_update(iscritti, ['authcode'], batch_size=settings.QUERY_CHUNK_SIZE)
+                aggiorna_versione(gruppo_corrente().id)
+
+            send_packed_messages(
+                [f'Authcode per {clean_message(iscritto.nome)} {clean_message(iscritto.cognome)}: *{clean_message(iscritto.authcode)}*'
+                 for iscritto in iscritti],
+                t_chat["id"])
+            send_message(f'Aggiornati *{len(iscritti)}* authcode', t_chat["id"])
         return JsonResponse({"ok": "POST request processed"})
 
     def crea_admin(self, s: list, t_user: str, t_chat: dict) -> JsonResponse:
@@ -464,7 +756,7 @@ class CocaBotView(View):
         if len(s) < 2:
             send_message("Non mi hai dato niente da cercare\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
-        iscritti_set = get_iscritto_by_codice(s[1])
+        iscritti_set = get_iscritto_by_codice(s[1], primario=True)
         if iscritti_set.count() != 1:
             send_message(f'L\'iscritto {s[1]} non è valido', t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
@@ -500,7 +792,7 @@ class CocaBotView(View):
         if len(s) < 2:
             send_message("Non mi hai dato niente da cercare\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
-        iscritti_set = get_iscritto_by_codice(s[1])
+        iscritti_set = get_iscritto_by_codice(s[1], primario=True)
         if iscritti_set.count() != 1:
             send_message(f'L\'iscritto {s[1]} non è valido', t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
@@ -532,7 +824,7 @@ class CocaBotView(View):
         if len(s) < 2:
             send_message("Non mi hai dato niente da cercare\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
-        iscritti_set = get_iscritto_by_codice(s[1])
+        iscritti_set = get_iscritto_by_codice(s[1], primario=True)
         if iscritti_set.count() != 1:
             send_message(f'L\'iscritto {s[1]} non è valido', t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
@@ -550,6 +842,8 @@ class CocaBotView(View):
                 send_message('Qualcosa non ha funzionato...', t_chat["id"])
                 return JsonResponse({"ok": "POST request processed"})
         iscritto.active = status
+        # A choice of the admins, the sync no longer turns the member back on
+        iscritto.disattivato_da_sync = False
         iscritto.save()
         send_message(f'{clean_message(iscritto.nome)} {clean_message(iscritto.cognome)} è stato {"" if status else "dis"}attivat{self.get_gendered_string(iscritto.sesso,"o", "a")}', t_chat["id"])
         return JsonResponse({"ok": "POST request processed"})
@@ -561,7 +855,7 @@ class CocaBotView(View):
             send_message("Non mi hai dato niente da cercare\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
 
-        iscritti_set = get_iscritto_by_codice(s[1])
+        iscritti_set = get_iscritto_by_codice(s[1], primario=True)
 
         if iscritti_set.count() != 1:
             send_message(f'L\'iscritto {s[1]} non è valido', t_chat["id"])
@@ -585,7 +879,7 @@ class CocaBotView(View):
             send_message("Non mi hai dato niente da cercare\!", t_chat["id"])
             return JsonResponse({"ok": "POST request processed"})
 
-        iscritti_set = get_iscritto_by_codice(s[1])
+        iscritti_set = get_iscritto_by_codice(s[1], primario=True)
 
         if iscritti_set.count() != 1:
             send_message(f'L\'iscritto {s[1]} non è valido', t_chat["id"])
@@ -610,55 +904,197 @@ class CocaBotView(View):
                 except:
                     max_days = 7
             log_set = get_logs_by_date_gte(max_days)
-            for logentry in log_set:
-                text=clean_message(f"{logentry.log_time}: {logentry.username} - {logentry.command}")
-                send_message(text,t_chat['id'])
+            send_packed_messages(
+                [clean_message(f"{logentry.log_time}: {logentry.username} - {logentry.command}") for logentry in log_set],
+                t_chat['id'])
 
         return JsonResponse({"ok": "POST request processed"})
 
 
     def aggiorna_lista(self, s: list, t_user: str, t_chat: dict) -> JsonResponse:
         if self.check_admin(t_user, t_chat["id"]):
-            url = settings.SHAREPOINT_URL
-            username = settings.SHAREPOINT_USERNAME
-            password = settings.SHAREPOINT_PASSWORD
-            documents = settings.DOCUMENTS_URL
-            loader = DataLoader(url, username, password, documents)
+            gruppo = gruppo_corrente()
+            url = gruppo.impostazione('sharepoint_url')
+            username = gruppo.impostazione('sharepoint_username')
+            password = gruppo.impostazione('sharepoint_password')
+            documents = s[1:] if len(s) > 1 else gruppo.impostazione('documents_url')
+            loader = DataLoader(url, username, password, documents, gruppo)
             send_message('Sto leggendo il file excel remoto', t_chat["id"])
-            (nuovi, aggiornati) = loader.loadRemoteIntoDb()
-            send_message(f'Ho inserito {nuovi} nuovi iscritti e aggiornato gli altri {aggiornati}', t_chat["id"])
+            report = loader.loadRemoteIntoDb()
+            send_message(f'*Aggiornamento completato*\n{clean_message(report.summary())}', t_chat["id"])
+            send_packed_messages([clean_message(riga) for riga in report.details()], t_chat["id"])
         return JsonResponse({"ok": "POST request processed"})
 
     def invia_codice_per_mail(self, to_user: str, chat_id: int) -> JsonResponse:
-        iscritto_set = get_iscritto_by_codice(to_user)
-        iscritto_set.filter(
-            Q(authcode__isnull=False) |
-            Q(email__isnull=False)
-        )
-        if iscritto_set.count() == 1:
+        iscritto_set = [
+            iscritto for iscritto in cerca_iscritto_per_codice(to_user)
+            if iscritto.authcode is not None and iscritto.email is not None
+        ]
+        if len(iscritto_set) == 1:
             iscritto = iscritto_set[0]
-            if (iscritto.authcode is not None) & (iscritto.email is not None):
-                subject = "Accesso al bot telegram della Comunità Capi Avellino 1"
-                message = f'Ciao {iscritto.nome} {iscritto.cognome},\n' \
-                          f'Per accedere al bot devi essere autenticat{self.get_gendered_string(iscritto.sesso, "o", "a")}.\n' \
-                          f'Il tuo codice autorizzazione e\' {iscritto.authcode}' \
-                          f'Accedi al bot con telegram t.me/AV1CoCaBot e digita il comando /registrami {iscritto.authcode}.\n' \
-                          f'Fraternamente,\n' \
-                          f'Il tuo amico bot di quartiere'
-                message_html = f'<p>Ciao {iscritto.nome} {iscritto.cognome},</p>' \
-                               f'<p>Per accedere al bot devi essere autenticat{self.get_gendered_string(iscritto.sesso, "o", "a")}.<br/>' \
-                               f'Il tuo codice autorizzazione &egrave; <strong>{iscritto.authcode}</strong></p>' \
-                               f'<p>Accedi al bot con telegram <a href="https://t.me/AV1CoCaBot">https://t.me/AV1CoCaBot</a> e digita il comando /registrami {iscritto.authcode}.</p>' \
-                               f'<p>Fraternamente,<br/>' \
-                               f'Il tuo amico bot di quartiere</p>'
-                email_from = settings.EMAIL_FROM
-                recipient_list = iscritto.email.split(';')
-                send_mail(subject, message, email_from, recipient_list, fail_silently=False, html_message=message_html)
-                send_message('Email inviata\!', chat_id)
-                return JsonResponse({"ok": "POST request processed"})
+            MAIL_QUEUE.submit(
+                [(f'{iscritto.nome} {iscritto.cognome}', self.build_codice_mail(iscritto))],
+                lambda results: send_message(
+                    'Email inviata\!' if results[0][1] else 'Non sono riuscito a inviare l\'email, riprova più tardi\!',
+                    chat_id)
+            )
+            return JsonResponse({"ok": "POST request processed"})
         send_message('Non ti ho trovato nell\'elenco, chiedi aiuto ai capigruppo\!', chat_id)
         return JsonResponse({"ok": "POST request processed"})
 
+    def invia_codici_per_mail(self, s: list, t_user: str, t_chat: dict) -> JsonResponse:
+        if not self.check_admin(t_user, t_chat["id"]):
+            return JsonResponse({"ok": "POST request processed"})
+        iscritti_set = get_iscritti_gruppo().filter(
+            Q(active=True) &
+            Q(authcode__isnull=False) &
+            Q(email__isnull=False) &
+            Q(telegram_id__isnull=True)
+        )
+        if s[1] != 'tutti':
+            iscritti_set = iscritti_set.filter(branca=BRANCHE[s[1]])
+
+        messages = [
+            (f'{iscritto.nome} {iscritto.cognome}', self.build_codice_mail(iscritto))
+            for iscritto in stream(iscritti_set, 'mail')
+        ]
+        if len(messages) < 1:
+            send_message('Non trovo iscritti da abilitare con un indirizzo email', t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+
+        MAIL_QUEUE.submit(messages, lambda results: self.send_mail_report(results, t_chat["id"]))
+        send_message(f'Sto inviando *{len(messages)}* email, ti mando il resoconto appena ho finito', t_chat["id"])
+        return JsonResponse({"ok": "POST request processed"})
+
+    def annuncio(self, s: list, t_user: str, t_chat: dict, t_user_name: str, t_text: str) -> JsonResponse:
+        if not self.check_admin(t_user, t_chat["id"]):
+            return JsonResponse({"ok": "POST request processed"})
+        if (len(s) < 3) | ((s[1] != 'tutti') & (s[1] not in BRANCHE)):
+            send_message('Usa /annuncio tutti \<testo\> oppure /annuncio \<branca\> \<testo\>', t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+
+        # Keep the original casing and spacing of the announcement
+        testo = t_text.strip().split(maxsplit=2)[2]
+        annuncio = Annunci.objects.create(
+            gruppo=gruppo_corrente(),
+            autore=t_user_name,
+            chat_id=t_chat["id"],
+            testo=f'*Annuncio da @{clean_message(t_user_name)}*\n{clean_message(testo)}',
+            branca=None if s[1] == 'tutti' else BRANCHE[s[1]],
+        )
+        BROADCASTER.submit(annuncio.id)
+        send_message('Sto inviando l\'annuncio, ti mando il resoconto appena ho finito', t_chat["id"])
+        return JsonResponse({"ok": "POST request processed"})
+
+    def statistiche(self, t_user: str, t_chat: dict) -> JsonResponse:
+        if not self.check_admin(t_user, t_chat["id"]):
+            return JsonResponse({"ok": "POST request processed"})
+        righe = list(
+            Statistiche.objects.filter(gruppo=gruppo_corrente())
+            .order_by('ordine', '-totale', 'valore')
+            .values_list('dimensione', 'valore', 'totale', 'aggiornato')
+        )
+        if len(righe) < 1:
+            send_message('Statistiche non ancora calcolate, aggiorna la lista soci con /aggiorna', t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+
+        per_dimensione = {}
+        for dimensione, valore, totale, aggiornato in righe:
+            per_dimensione.setdefault(dimensione, []).append((valore, totale))
+        message_text = f'*Statistiche al {clean_message(f"{timezone.localtime(righe[0][3]):%d/%m/%Y %H:%M}")}*\n' \
+                       f'*Iscritti attivi:* {per_dimensione.get("totale", [("", 0)])[0][1]}\n'
+        for dimensione, titolo, campo, etichette in DIMENSIONI:
+            if dimensione in per_dimensione:
+                message_text += f'\n*{clean_message(titolo)}*\n'
+                message_text += ''.join(
+                    f'{clean_message(valore)}: {totale}\n' for valore, totale in per_dimensione[dimensione]
+                )
+        send_message(message_text, t_chat["id"])
+        return JsonResponse({"ok": "POST request processed"})
+
+    def statistiche_cache(self, t_user: str, t_chat: dict) -> JsonResponse:
+        if self.check_super_admin(t_user, t_chat["id"]):
+            stats = RISULTATI.stats()
+            richieste = stats['hits'] + stats['misses']
+            send_message(
+                f'*Cache ricerche di questo processo*\n'
+                f'*Hit:* {stats["hits"]}\n'
+                f'*Miss:* {stats["misses"]}\n'
+                f'*Hit rate:* {round(100 * stats["hits"] / richieste) if richieste else 0}%\n'
+                f'*Voci:* {stats["size"]}/{stats["maxsize"]}',
+                t_chat["id"])
+        return JsonResponse({"ok": "POST request processed"})
+
+    def richiedi_profilo(self, s: list, t_user: str, t_chat: dict, t_user_name: str) -> JsonResponse:
+        if not self.check_super_admin(t_user, t_chat["id"]):
+            return JsonResponse({"ok": "POST request processed"})
+
+        if len(s) < 2:
+            profili = Profili.objects.filter(gruppo=gruppo_corrente()).order_by('-id')[:10]
+            send_packed_messages(
+                [clean_message(f'#{profilo.id} /{profilo.comando} {profilo.creato:%d/%m %H:%M}: '
+                               f'{profilo.durata_ms} ms, {profilo.campioni} campioni') for profilo in profili]
+                or ['Nessun profilo salvato'],
+                t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+
+        if s[1] == 'scarica':
+            try:
+                profilo = Profili.objects.get(gruppo=gruppo_corrente(), id=int(s[2]))
+            except (IndexError, ValueError, Profili.DoesNotExist):
+                send_message('Usa /profila scarica \<numero del profilo\>', t_chat["id"])
+                return JsonResponse({"ok": "POST request processed"})
+            invia_profilo(profilo, t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+
+        try:
+            volte = int(s[2]) if len(s) > 2 else 1
+        except ValueError:
+            volte = 0
+        if volte < 1:
+            send_message('Usa /profila \<comando\> \[volte\]', t_chat["id"])
+            return JsonResponse({"ok": "POST request processed"})
+        comando = s[1].lstrip('/')
+        Profilazioni.objects.create(
+            gruppo=gruppo_corrente(),
+            autore=t_user_name,
+            chat_id=t_chat["id"],
+            comando=comando,
+            rimanenti=volte,
+        )
+        send_message(f'Profilerò le prossime {volte} esecuzioni di /{clean_message(comando)}', t_chat["id"])
+        return JsonResponse({"ok": "POST request processed"})
+
+    def send_mail_report(self, results: list, chat_id: int):
+        inviate = sum(1 for label, sent, error in results if sent)
+        send_packed_messages(
+            [f'{clean_message(label)}: {"inviata" if sent else clean_message(f"non inviata ({error})")}'
+             for label, sent, error in results],
+            chat_id)
+        send_message(f'*Email inviate:* {inviate}\n*Email non inviate:* {len(results) - inviate}', chat_id)
+
+    def build_codice_mail(self, iscritto: Iscritti) -> EmailMultiAlternatives:
+        gruppo = gruppo_corrente()
+        bot_username = gruppo.impostazione('bot_username')
+        subject = f"Accesso al bot telegram della Comunità Capi {gruppo.nome}"
+        message = f'Ciao {iscritto.nome} {iscritto.cognome},\n' \
+                  f'Per accedere al bot devi essere autenticat{self.get_gendered_string(iscritto.sesso, "o", "a")}.\n' \
+                  f'Il tuo codice autorizzazione e\' {iscritto.authcode}.\n' \
+                  f'Accedi al bot con telegram t.me/{bot_username} e digita il comando /registrami {iscritto.authcode}.\n' \
+                  f'Fraternamente,\n' \
+                  f'Il tuo amico bot di quartiere'
+        message_html = f'<p>Ciao {iscritto.nome} {iscritto.cognome},</p>' \
+                       f'<p>Per accedere al bot devi essere autenticat{self.get_gendered_string(iscritto.sesso, "o", "a")}.<br/>' \
+                       f'Il tuo codice autorizzazione &egrave; <strong>{iscritto.authcode}</strong></p>' \
+                       f'<p>Accedi al bot con telegram <a href="https://t.me/{bot_username}">https://t.me/{bot_username}</a> e digita il comando /registrami {iscritto.authcode}.</p>' \
+                       f'<p>Fraternamente,<br/>' \
+                       f'Il tuo amico bot di quartiere</p>'
+        email_from = gruppo.impostazione('email_from')
+        recipient_list = iscritto.email.split(';')
+        mail = EmailMultiAlternatives(subject, message, email_from, recipient_list)
+        mail.attach_alternative(message_html, 'text/html')
+        return mail
+
     def help(self, chat_id: int) -> JsonResponse:
         help_text = (
             ''
@@ -668,15 +1104,20 @@ class CocaBotView(View):
         help_text += '/codicesocio - Ottiene il codice socio di un socio del gruppo, si può cercare per cognome, nome, codice socio, codice fiscale o unità [L/C, E/G, R/S, Adulti]\n'
         help_text += '/generacodice - Genera il codice di autorizzazione per potersi abilitare all\'uso del bot\n'
         help_text += '/inviacodice - Invia il di autorizzazione per potersi abilitare all\'uso del bot all\'indirizzo email registrato su Buonastrada, si può cercare per codice socio, codice fiscale\n'
+        help_text += '/inviacodice tutti - Invia il codice di autorizzazione via email a tutti gli iscritti non ancora registrati, o solo a quelli di una branca [L/C, E/G, R/S, Adulti]. Solo per amministratori\n'
         help_text += '/registrami - Registra l\'account telegram al bot. Richiede codice di autorizzazione\n'
         help_text += '/aggiungiadmin - Aggiunge un amministratore del bot. Solo per amministratori\n'
         help_text += '/aggiungicapo - Aggiunge un un capo del gruppo. Solo per amministratori\n'
         help_text += '/rimuoviadmin - Rimuove un amministratore del bot. Solo per amministratori\n'
         help_text += '/rimuovicapo - Rimuove un un capo del gruppo. Solo per amministratori\n'
-        help_text += '/aggiorna - Aggiorna la lista soci dal file excel su onedrive. Solo per amministratori\n'
+        help_text += '/aggiorna - Aggiorna la lista soci dai file excel su onedrive, si possono indicare uno o più file al posto di quelli configurati. Solo per amministratori\n'
         help_text += '/attiva - Attiva un iscritto. Solo per amministratorii\n'
         help_text += '/disattiva - Disattiva un iscritto. Solo per amministratori\n'
         help_text += '/abilitati - Lista abilitati. Solo per amministratori\n'
+        help_text += '/statistiche - Conteggi degli iscritti attivi per branca, sesso, età, Fo.Ca. e consensi privacy, aggiornati a ogni /aggiorna. Solo per amministratori\n'
+        help_text += '/annuncio - Invia un annuncio a tutti gli abilitati o a una branca, es. /annuncio tutti testo oppure /annuncio eg testo. Solo per amministratori\n'
+        help_text += '/cache - Hit e miss della cache delle ricerche. Solo per super amministratori\n'
+        help_text += '/profila - Profila le prossime esecuzioni di un comando, es. /profila info 3. Senza comando elenca i profili salvati, /profila scarica numero invia il profilo. Solo per super amministratori\n'
         help_text += '/help - Mostra questa guida ai comandi\n'
         send_message(clean_message(help_text), chat_id)
         return JsonResponse({"ok": "POST request processed"})
@@ -702,23 +1143,31 @@ class CocaBotView(View):
                 self.send_not_authorized_message(chat_id)
             return False
 
-        try:
-            user: Iscritti = Iscritti.objects.get(telegram_id__iexact=t_user)
-        except Iscritti.DoesNotExist:
-            # print("Ko")
-            if send_message_back:
-                self.send_not_authorized_message(chat_id)
-            return False
-        except Iscritti.MultipleObjectsReturned:
-            # print("Ko")
-            if send_message_back:
-                self.send_not_authorized_message(chat_id)
-            return False
-        except:
-            # print("Ko")
-            if send_message_back:
-                self.send_not_authorized_message(chat_id)
-            return False
+        if settings.ISCRITTI_SNAPSHOT:
+            trovati = snapshot_iscritti().per_telegram_id(t_user)
+            if len(trovati) != 1:
+                if send_message_back:
+                    self.send_not_authorized_message(chat_id)
+                return False
+            user = trovati[0]
+        else:
+            try:
+                user: Iscritti = get_iscritti_gruppo().get(telegram_id__iexact=t_user)
+            except Iscritti.DoesNotExist:
+                # print("Ko")
+                if send_message_back:
+                    self.send_not_authorized_message(chat_id)
+                return False
+            except Iscritti.MultipleObjectsReturned:
+                # print("Ko")
+                if send_message_back:
+                    self.send_not_authorized_message(chat_id)
+                return False
+            except:
+                # print("Ko")
+                if send_message_back:
+                    self.send_not_authorized_message(chat_id)
+                return False
 
         if user.role in roles:
             # print("Ok")
@@ -730,7 +1179,7 @@ class CocaBotView(View):
 
     def check_role_for_iscritto(self, search_string: str, roles: list):
         try:
-            user: Iscritti = Iscritti.objects.get(
+            user: Iscritti = get_iscritti_gruppo().get(
                 Q(codice_socio=search_string) |
                 Q(codice_fiscale__iexact=search_string)
             )
@@ -0,0 +1,61 @@
+import hmac
+
+from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import HttpResponseForbidden
+from django.utils.module_loading import import_string
+
+from coca_bot.gruppi import get_gruppo
+from coca_bot.views import CocaBotView
+
+
+class SecretTokenMiddleware(object):
+    """Rejects webhook calls whose X-Telegram-Bot-Api-Secret-Token does not match the secret of the group.
+
+    It replaces CSRF for CocaBotView, and other views are not touched. A group without a secret is
+    rejected too, except with DEBUG on: set it with the imposta_webhook command.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'view_class', None) is not CocaBotView:
+            return None
+        gruppo = get_gruppo(view_kwargs.get('gruppo', settings.DEFAULT_GRUPPO))
+        if gruppo is None:
+            # The view answers 404
+            return None
+        secret = gruppo.impostazione('webhook_secret')
+        if not secret:
+            # Fails closed, anyone knowing the slug could send updates as any user
+            return None if settings.DEBUG else HttpResponseForbidden()
+        ricevuto = request.META.get('HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN', '')
+        if not hmac.compare_digest(ricevuto.encode(), secret.encode()):
+            return HttpResponseForbidden()
+        return None
+
+
+class WebhookHandler(WSGIHandler):
+    """WSGI handler running WEBHOOK_MIDDLEWARE instead of MIDDLEWARE, synchronous middleware only."""
+
+    def load_middleware(self, is_async=False):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(settings.WEBHOOK_MIDDLEWARE):
+            mw_instance = import_string(middleware_path)(handler)
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.insert(0, mw_instance.process_view)
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.append(mw_instance.process_template_response)
+            if hasattr(mw_instance, 'process_exception'):
+                self._exception_middleware.append(mw_instance.process_exception)
+            handler = convert_exception_to_response(mw_instance)
+        self._middleware_chain = handler
@@ -0,0 +1,7 @@
+# Loaded by the web process in the Procfile
+
+
+def post_worker_init(worker):
+    # The application is loaded by now: connect and fill the caches before the first update
+    from coca_bot.connessioni import preriscalda_worker
+    preriscalda_worker()
@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from coca_bot.models import Annunci
+from coca_bot.recapiti import invia_o_salva
+from utils.TelegramClient import TelegramClient
+
+# Outcome of deliver when Telegram is down: nothing is counted and the checkpoint stays where it is
+INTERROTTO = 'interrotto'
+
+
+class Broadcaster(object):
+    """Fans announcements out to their recipients within the Bot API broadcast limits.
+
+    The checkpoint on the Annunci row is saved after every recipient, so a restarted
+    process resumes from the last member reached instead of sending everything again.
+    ``aggiornato`` doubles as a lease: a process broadcasts only after moving it forward
+    from the value it read, and stops as soon as another process moved it first. During a
+    Telegram outage the broadcast stops without moving it, and resume picks it up again
+    once the lease expires.
+    """
+    _interval = None
+    _next_send = 0
+    _queue = None
+    _worker = None
+    _lock = None
+
+    def __init__(self, messages_per_second: float = 25):
+        self._interval = 1 / messages_per_second
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, annuncio_id: int):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+                self._worker.start()
+        self._queue.put(annuncio_id)
+
+    def join(self):
+        """Blocks until every submitted announcement has been delivered."""
+        self._queue.join()
+
+    def resume(self) -> int:
+        """Delivers the announcements left behind by a process that is no longer updating them."""
+        ripresi = 0
+        scadenza = timezone.now() - timedelta(seconds=settings.ANNUNCI_LEASE_SECONDS)
+        annunci = Annunci.objects.select_related('gruppo').filter(completato=False, aggiornato__lt=scadenza)
+        for annuncio in annunci.order_by('id'):
+            # Only one process wins the lease, the others skip the announcement
+            if self.claim(annuncio):
+                self.broadcast(annuncio)
+                ripresi += 1
+        return ripresi
+
+    def claim(self, annuncio: Annunci) -> bool:
+        """Takes the lease, False when another process moved it since the announcement was read."""
+        return self.checkpoint(annuncio)
+
+    def checkpoint(self, annuncio: Annunci, *fields) -> bool:
+        """Saves the fields and renews the lease, False when another process took the announcement over."""
+        adesso = timezone.now()
+        valori = {field: getattr(annuncio, field) for field in fields}
+        aggiornati = Annunci.objects.filter(
+            id=annuncio.id, aggiornato=annuncio.aggiornato, completato=False
+        ).update(aggiornato=adesso, **valori)
+        if aggiornati != 1:
+            return False
+        annuncio.aggiornato = adesso
+        return True
+
+    def broadcast(self, annuncio: Annunci) -> Annunci:
+        """Sends the announcement to the recipients after the checkpoint, the caller holds the lease."""
+        client = annuncio.gruppo.telegram()
+        while True:
+            destinatari = list(
+                annuncio.destinatari().values_list('id', 'telegram_id')[:settings.QUERY_CHUNK_SIZE]
+            )
+            if len(destinatari) < 1:
+                break
+            for iscritto_id, telegram_id in destinatari:
+                esito = self.deliver(client, annuncio.testo, telegram_id[2:])
+                if esito == INTERROTTO:
+                    print(f'Annuncio {annuncio.id} interrotto, Telegram non disponibile')
+                    return annuncio
+                setattr(annuncio, esito, getattr(annuncio, esito) + 1)
+                annuncio.ultimo_iscritto = iscritto_id
+                if not self.checkpoint(annuncio, 'ultimo_iscritto', esito):
+                    # Resumed elsewhere after this process stalled past the lease
+                    return annuncio
+
+        annuncio.completato = True
+        if not self.checkpoint(annuncio, 'completato'):
+            return annuncio
+        invia_o_salva(annuncio.gruppo, 'sendMessage', {
+            "chat_id": annuncio.chat_id,
+            "text": f'*Annuncio inviato*\n'
+                    f'*Consegnati:* {annuncio.consegnati}\n'
+                    f'*Bloccati:* {annuncio.bloccati}\n'
+                    f'*Falliti:* {annuncio.falliti}',
+            "parse_mode": "MarkdownV2",
+        })
+        return annuncio
+
+    def deliver(self, client: TelegramClient, text: str, chat_id) -> str:
+        for attempt in range(5):
+            self._throttle()
+            try:
+                response = client.sendMessage(text, chat_id)
+            except requests.RequestException:
+                # Includes TelegramUnavailable, the breaker is open
+                return INTERROTTO
+            if response.status_code >= 500:
+                return INTERROTTO
+            if response.status_code == 200:
+                return 'consegnati'
+            if response.status_code == 403:
+                # The user blocked the bot or deleted the account
+                return 'bloccati'
+            if response.status_code != 429:
+                return 'falliti'
+            try:
+                retry_after = response.json()['parameters']['retry_after']
+            except (ValueError, KeyError):
+                retry_after = 1
+            time.sleep(retry_after)
+        return 'falliti'
+
+    def _throttle(self):
+        wait = self._next_send - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_send = time.monotonic() + self._interval
+
+    def _run(self):
+        while True:
+            annuncio_id = self._queue.get()
+            try:
+                annuncio = Annunci.objects.select_related('gruppo').get(id=annuncio_id)
+                # Waited in the queue past the lease, invia_annunci may have resumed it already
+                if self.claim(annuncio):
+                    self.broadcast(annuncio)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                connection.close()
+                self._queue.task_done()
@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """Stops calling an upstream after repeated failures.
+
+    After ``failures`` consecutive failures the breaker opens and refuses every call
+    for ``reset_timeout`` seconds. Then it lets a single probe through (half open):
+    a success closes it again, a failure opens it for another period.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _failures = None
+    _reset_timeout = None
+    _lock = None
+    state = CLOSED
+    consecutive_failures = 0
+    _changed_at = 0
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30):
+        self._failures = failures
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # Also covers a probe that never reported back
+            if time.monotonic() - self._changed_at >= self._reset_timeout:
+                self.state = self.HALF_OPEN
+                self._changed_at = time.monotonic()
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def recordFailure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self._failures:
+                self.state = self.OPEN
+                self._changed_at = time.monotonic()
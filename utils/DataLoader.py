@@ -1,85 +1,291 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 from office365.runtime.auth.user_credential import UserCredential
 from office365.sharepoint.files.file import File
 import pandas as pd
-import tempfile
-import os
-from django.db import transaction
+import io
+import contextlib
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
 
-from coca_bot.models import Iscritti
+from coca_bot.models import Documenti, Iscritti
+from coca_bot.snapshot import aggiorna_versione
+from coca_bot.statistiche import aggiorna_statistiche
+from coca_bot.tracing import TRACER
+from utils.DownloadBuffer import DownloadBuffer
 import numpy as np
 
 
+# Columns owned by the census workbook, everything else is managed from the bot
+CAMPI_SINCRONIZZATI = [
+    'codice_socio', 'nome', 'cognome', 'sesso', 'data_di_nascita', 'comune_di_nascita', 'indirizzo', 'civico',
+    'comune', 'provincia', 'cap', 'informativa2a', 'informativa2b', 'consenso_immagini', 'livello_foca', 'coca',
+    'branca', 'cellulare', 'email',
+]
+
+
+class SyncReport(object):
+    """Outcome of a sync: counts of new, changed, unchanged and reactivated members, deactivated codes and changes per field."""
+
+    def __init__(self, nuovi: int, modificati: int, invariati: int, disattivati: list, campi: dict, duplicati: list,
+                 riattivati: int = 0, parziale: bool = False, saltato: bool = False):
+        self.nuovi = nuovi
+        self.modificati = modificati
+        self.invariati = invariati
+        self.disattivati = disattivati
+        self.campi = campi
+        self.duplicati = duplicati
+        self.riattivati = riattivati
+        # Only some of the configured workbooks were loaded, nobody was deactivated
+        self.parziale = parziale
+        # The workbooks matched the checksums of the last full load, nothing was parsed or compared
+        self.saltato = saltato
+
+    def changed(self) -> bool:
+        return bool(self.nuovi or self.modificati or self.disattivati or self.riattivati)
+
+    def summary(self) -> str:
+        """Counts only, short enough for one Telegram message whatever the size of the register."""
+        if self.saltato:
+            return 'File invariati dall\'ultimo aggiornamento completo, nessuna modifica'
+        text = f'Nuovi iscritti: {self.nuovi}\n' \
+               f'Modificati: {self.modificati}'
+        if self.campi:
+            text += ' (' + ', '.join(f'{campo} {numero}' for campo, numero in self.campi.items()) + ')'
+        text += f'\nInvariati: {self.invariati}\n' \
+                f'Riattivati: {self.riattivati}\n' \
+                f'Disattivati: {len(self.disattivati)}'
+        if self.parziale:
+            text += ' (caricati solo alcuni dei file configurati)'
+        if self.duplicati:
+            text += f'\nPresenti in più file: {len(self.duplicati)}'
+        return text
+
+    def details(self) -> list:
+        """One line per deactivated or duplicated codice fiscale, to send packed after the summary."""
+        return [f'Disattivato: {codice}' for codice in self.disattivati] + \
+               [f'Presente in più file: {codice}' for codice in self.duplicati]
+
+
+def parseWorkbook(workbook) -> pd.DataFrame:
+    """Parses a census workbook from a file object, or from its bytes in the worker processes of the pool."""
+    if isinstance(workbook, bytes):
+        workbook = io.BytesIO(workbook)
+    df = pd.read_excel(workbook, engine='openpyxl', converters={'ProvinciaResidenza': str})
+    df['DataDiNascita'] = pd.to_datetime(df.DataNascita).dt.strftime('%Y-%m-%d')
+    return df
+
+
 class DataLoader(object):
     _url = None
     _username = None
     _password = None
-    _document = None
-    _abs_file_url = None
+    _documents = None
+    _gruppo = None
+    _processi = None
+    _incrementale = None
+    duplicati = None
+    checksums = None
 
-    def __init__(self, url, username, password, document):
+    def __init__(self, url, username, password, documents, gruppo, processi: int = 1, incrementale: bool = False):
+        self._gruppo = gruppo
+        # Parsing in a pool forks the process, never done from a web worker with threads and open connections
+        self._processi = processi
+        # Skips parsing and diff when every workbook matches the last full load
+        self._incrementale = incrementale
         self._url = url
         self._username = username
         self._password = password
-        self._document = document
-        self._abs_file_url = f'{self._url}{self._document}'
+        self._documents = self.documentList(documents)
+        self.duplicati = []
+        # SHA-256 of each downloaded workbook, by document
+        self.checksums = {}
+
+    @staticmethod
+    def documentList(documents) -> list:
+        # A single document or several, either as a list or comma separated
+        if isinstance(documents, str):
+            documents = documents.split(',')
+        return [document.strip() for document in documents or [] if document.strip()]
+
+    def loadsEveryDocument(self) -> bool:
+        """Whether every configured workbook is loaded, only then the missing members left the group."""
+        return set(self.documentList(self._gruppo.impostazione('documents_url'))) <= set(self._documents)
+
+    def documentsUnchanged(self) -> bool:
+        """Whether every downloaded workbook has the checksum saved by the last full load."""
+        salvati = dict(
+            Documenti.objects.using(DEFAULT_DB_ALIAS).filter(gruppo=self._gruppo).values_list('nome', 'checksum')
+        )
+        return bool(self.checksums) and salvati == self.checksums
 
-    def loadRemoteToDataframe(self) -> pd.DataFrame:
-        if (not self._abs_file_url) | (not self._username) | (not self._password) | (not self._url) | (
-        not self._document):
+    def loadRemoteToDataframe(self):
+        """The workbooks as one dataframe, None in an incremental sync when none of them changed."""
+        if (not self._username) | (not self._password) | (not self._url) | (not self._documents):
             data = f'- username: {self._username}\n' \
                    f'- password: {self._password}\n' \
                    f'- url: {self._url}\n' \
-                   f'- document: {self._document}\n' \
-                   f'- full_url: {self._abs_file_url}\n'
+                   f'- documents: {self._documents}\n'
             raise Exception(f'Dati richiesti mancanti\n{data}')
         user_credentials = UserCredential(self._username, self._password)
-        with tempfile.TemporaryDirectory() as local_path:
-            file_name = os.path.basename(self._abs_file_url)
-            with open(os.path.join(local_path, file_name), 'wb') as local_file:
-                file = File.from_url(self._abs_file_url).with_credentials(user_credentials).download(
-                    local_file).execute_query()
-                # print("'{0}' file has been downloaded into {1}".format(file.serverRelativeUrl, local_file.name))
-                df = pd.read_excel(local_file.name, engine='openpyxl', converters={'ProvinciaResidenza': str})
-                df['DataDiNascita'] = pd.to_datetime(df.DataNascita).dt.strftime('%Y-%m-%d')
-                return df
-
-    def loadRemoteIntoDb(self) -> (int, int):
+        with contextlib.ExitStack() as stack:
+            downloaded = [
+                stack.enter_context(DownloadBuffer(settings.DATALOADER_MAX_BYTES, settings.DATALOADER_SPOOL_BYTES))
+                for _ in self._documents
+            ]
+
+            def download(document, buffer):
+                # Streamed in chunks, the size limit stops the download as soon as it is passed
+                File.from_url(f'{self._url}{document}').with_credentials(user_credentials).download_session(
+                    buffer).execute_query()
+
+            with TRACER.span('dataloader.download', documents=len(self._documents)):
+                with ThreadPoolExecutor(max_workers=len(self._documents)) as downloader:
+                    list(downloader.map(download, self._documents, downloaded))
+                self.checksums = {
+                    document: buffer.checksum() for document, buffer in zip(self._documents, downloaded)
+                }
+                TRACER.annotate(bytes=sum(buffer.size for buffer in downloaded), checksums=self.checksums)
+            if self._incrementale and self.documentsUnchanged():
+                TRACER.annotate(invariati=True)
+                return None
+
+            with TRACER.span('dataloader.parse', documents=len(downloaded)):
+                if len(downloaded) == 1 or self._processi < 2:
+                    frames = [parseWorkbook(buffer.reader()) for buffer in downloaded]
+                else:
+                    # The workers get the bytes, the buffers stay in this process
+                    workers = min(len(downloaded), self._processi)
+                    with ProcessPoolExecutor(max_workers=workers) as parser:
+                        frames = list(parser.map(parseWorkbook, [buffer.content() for buffer in downloaded]))
+
+        df = pd.concat(frames, ignore_index=True)
+        df['CodiceFiscale'] = df.CodiceFiscale.astype(str).str.strip()
+        # A member listed in more than one workbook keeps the row of the last one
+        duplicati = df.duplicated('CodiceFiscale', keep='last')
+        self.duplicati = sorted(df.CodiceFiscale[duplicati].unique())
+        return df[~duplicati]
+
+    def recordToFields(self, record) -> dict:
+        cellulare = None if str(record.Cellulare) == 'nan' else record.Cellulare
+        email = None if str(record.Email) == 'nan' else record.Email
+        return {
+            'codice_fiscale': str(record.CodiceFiscale).strip(),
+            'codice_socio': str(record.CodiceSocio).strip(),
+            'nome': record.Nome.strip(),
+            'cognome': record.Cognome.strip(),
+            'sesso': record.Sesso.strip(),
+            'data_di_nascita': record.DataDiNascita,
+            'comune_di_nascita': record.ComuneNascita.strip(),
+            'indirizzo': record.Indirizzo.strip(),
+            'civico': record.Civico.strip(),
+            'comune': record.ComuneResidenza.strip(),
+            'provincia': (str(record.ProvinciaResidenza).strip())[:2].upper(),
+            'cap': str(record.Cap).strip(),
+            'informativa2a': (record.Informativa2a == 'Si'),
+            'informativa2b': (record.Informativa2b == 'Si'),
+            'consenso_immagini': (record.ConsensoImmagini == 'Si'),
+            'livello_foca': record.LivelloFoCa.strip(),
+            'coca': (record.CUN == 'G'),
+            'branca': record.Branca.strip(),
+            'cellulare': cellulare if cellulare is None else str(cellulare).strip(),
+            'email': email if email is None else email.strip(),
+        }
+
+    def saveChecksums(self):
+        """Records the workbooks just loaded, a later sync compares its downloads against them."""
+        caricato = timezone.now()
+        # A workbook dropped from the configuration no longer describes the register
+        Documenti.objects.filter(gruppo=self._gruppo).exclude(nome__in=self._documents).delete()
+        for document, checksum in self.checksums.items():
+            Documenti.objects.update_or_create(
+                gruppo=self._gruppo, nome=document, defaults={'checksum': checksum, 'caricato': caricato}
+            )
+
+    def loadDbToDataframe(self) -> pd.DataFrame:
+        colonne = ['id', 'active', 'disattivato_da_sync', 'codice_fiscale'] + CAMPI_SINCRONIZZATI
+        # The diff decides what is written, it never reads from a lagging replica
+        df = pd.DataFrame.from_records(
+            list(Iscritti.objects.using(DEFAULT_DB_ALIAS).filter(gruppo=self._gruppo).values_list(*colonne)), columns=colonne
+        )
+        # Compared with the strings coming from the workbook
+        df['data_di_nascita'] = df.data_di_nascita.astype(str)
+        return df
+
+    def loadRemoteIntoDb(self) -> SyncReport:
         df = self.loadRemoteToDataframe()
-        records = df.to_records()
-        nuovi = 0
-        aggiornati = 0
+        if df is None:
+            return SyncReport(nuovi=0, modificati=0, invariati=0, disattivati=[], campi={}, duplicati=[], saltato=True)
+        with TRACER.span('dataloader.fields', rows=len(df)):
+            remoto = pd.DataFrame(
+                [self.recordToFields(record) for record in df.to_records()],
+                columns=['codice_fiscale'] + CAMPI_SINCRONIZZATI
+            )
+        if remoto.empty:
+            # Never deactivate the whole register because of an empty or wrong file
+            raise Exception('Il file excel non contiene iscritti')
+
         with transaction.atomic():
-            for record in records:
-                cellulare = None if str(record.Cellulare) == 'nan' else record.Cellulare
-                email = None if str(record.Email) == 'nan' else record.Email
-                iscritto, created = Iscritti.objects.update_or_create(
-                    codice_fiscale=str(record.CodiceFiscale).strip(),
-                    defaults={
-                        'codice_fiscale': str(record.CodiceFiscale).strip(),
-                        'codice_socio': str(record.CodiceSocio).strip(),
-                        'nome': record.Nome.strip(),
-                        'cognome': record.Cognome.strip(),
-                        'sesso': record.Sesso.strip(),
-                        'data_di_nascita': record.DataDiNascita,
-                        'comune_di_nascita': record.ComuneNascita.strip(),
-                        'indirizzo': record.Indirizzo.strip(),
-                        'civico': record.Civico.strip(),
-                        'comune': record.ComuneResidenza.strip(),
-                        'provincia': (str(record.ProvinciaResidenza).strip())[:2].upper(),
-                        'cap': str(record.Cap).strip(),
-                        'informativa2a': (record.Informativa2a == 'Si'),
-                        'informativa2b': (record.Informativa2b == 'Si'),
-                        'consenso_immagini': (record.ConsensoImmagini == 'Si'),
-                        'livello_foca': record.LivelloFoCa.strip(),
-                        'coca': (record.CUN == 'G'),
-                        'branca': record.Branca.strip(),
-                        'cellulare': cellulare if cellulare is None else str(cellulare).strip(),
-                        'email': email if email is None else email.strip(),
-                    })
-                if created:
-                    nuovi += 1
-                else:
-                    aggiornati += 1
+            with TRACER.span('dataloader.diff'):
+                confronto = remoto.merge(
+                    self.loadDbToDataframe(), on='codice_fiscale', how='outer', suffixes=('', '_db'), indicator=True
+                )
+                presenti = confronto._merge == 'both'
+                differenze = pd.DataFrame({
+                    campo: presenti & ~(
+                        (confronto[campo] == confronto[f'{campo}_db']) |
+                        (confronto[campo].isna() & confronto[f'{campo}_db'].isna())
+                    )
+                    for campo in CAMPI_SINCRONIZZATI
+                })
+                modificati = differenze.any(axis=1)
+                aggiunti = confronto._merge == 'left_only'
+                # A partial load, e.g. /aggiorna with one branca's file, says nothing about the other members
+                completo = self.loadsEveryDocument()
+                mancanti = (confronto._merge == 'right_only') & (confronto.active == True) & completo
+                # Back in the census after a sync turned them off, the ones turned off from the bot stay off
+                riattivati = presenti & (confronto.active == False) & (confronto.disattivato_da_sync == True)
+
+            def iscritti(righe, con_id: bool) -> list:
+                colonne = confronto.loc[righe, ['codice_fiscale'] + CAMPI_SINCRONIZZATI].astype(object)
+                ids = confronto.id[righe].astype(int).tolist() if con_id else [None] * len(colonne)
+                return [
+                    Iscritti(id=iscritto_id, gruppo=self._gruppo, **fields)
+                    for iscritto_id, fields in zip(ids, colonne.where(colonne.notna(), None).to_dict('records'))
+                ]
+
+            campi_modificati = [campo for campo in CAMPI_SINCRONIZZATI if differenze[campo].any()]
+            with TRACER.span('dataloader.write', nuovi=int(aggiunti.sum()), modificati=int(modificati.sum())):
+                Iscritti.objects.bulk_create(iscritti(aggiunti, False), batch_size=settings.QUERY_CHUNK_SIZE)
+                if campi_modificati:
+                    Iscritti.objects.bulk_update(
+                        iscritti(modificati, True),
+                        campi_modificati,
+                        batch_size=settings.QUERY_CHUNK_SIZE
+                    )
+                Iscritti.objects.filter(
+                    gruppo=self._gruppo, id__in=confronto.id[mancanti].astype(int).tolist()
+                ).update(active=False, disattivato_da_sync=True)
+                Iscritti.objects.filter(
+                    gruppo=self._gruppo, id__in=confronto.id[riattivati].astype(int).tolist()
+                ).update(active=True, disattivato_da_sync=False)
+                aggiorna_versione(self._gruppo.id)
+                # In the same transaction, a failed write leaves the previous checksums. Only a full load
+                # also deactivated the members missing from every workbook, so only it can be skipped later
+                if completo:
+                    self.saveChecksums()
+
+        with TRACER.span('dataloader.statistiche'):
+            aggiorna_statistiche(self._gruppo)
 
-        return nuovi, aggiornati
-                # print(f'{"CREATO" if created else "AGGIORNATO"} {iscritto.nome} {iscritto.cognome}')
+        return SyncReport(
+            nuovi=int(aggiunti.sum()),
+            modificati=int(modificati.sum()),
+            invariati=int((presenti & ~modificati).sum()),
+            disattivati=list(confronto.codice_fiscale[mancanti]),
+            campi={campo: int(differenze[campo].sum()) for campo in campi_modificati},
+            duplicati=self.duplicati,
+            riattivati=int(riattivati.sum()),
+            parziale=not completo,
+        )
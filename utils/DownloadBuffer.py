@@ -0,0 +1,50 @@
+import hashlib
+import tempfile
+
+
+class DownloadTooLarge(Exception):
+    """The download went past the limit of the buffer, the rest was not read."""
+
+
+class DownloadBuffer(object):
+    """File object a download is written into.
+
+    The bytes stay in memory up to ``spool`` bytes and spill to a temporary file past that.
+    They are hashed as they arrive, and a write going past ``limit`` bytes raises DownloadTooLarge.
+    """
+    _file = None
+    _hash = None
+    _limit = None
+    size = 0
+
+    def __init__(self, limit: int = 0, spool: int = 10 * 1024 * 1024, algorithm: str = 'sha256'):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool)
+        self._hash = hashlib.new(algorithm)
+        self._limit = limit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data: bytes) -> int:
+        if self._limit and self.size + len(data) > self._limit:
+            raise DownloadTooLarge(f'Download larger than {self._limit} bytes')
+        self.size += len(data)
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def checksum(self) -> str:
+        return self._hash.hexdigest()
+
+    def reader(self):
+        """The buffer rewound for reading, to hand to a parser."""
+        self._file.seek(0)
+        return self._file
+
+    def content(self) -> bytes:
+        return self.reader().read()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,87 @@
+import contextvars
+import queue
+import threading
+import time
+import traceback
+
+from django.core.mail import get_connection
+from django.db import close_old_connections
+
+
+class MailQueue(object):
+    """Delivers batches of emails from a background thread over a single reused connection.
+
+    Every batch is a list of ``(label, message)`` pairs; once the batch has been
+    processed the optional callback receives a ``(label, sent, error)`` tuple per message.
+    The callback runs in a copy of the context it was submitted from.
+    """
+    _queue = None
+    _worker = None
+    _lock = None
+    _retries = None
+    _retry_delay = None
+
+    def __init__(self, retries: int = 3, retry_delay: float = 5):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._retries = max(1, retries)
+        self._retry_delay = retry_delay
+
+    def submit(self, messages: list, on_complete=None):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._worker.start()
+        self._queue.put((messages, on_complete, contextvars.copy_context()))
+
+    def join(self):
+        """Blocks until every submitted batch has been delivered."""
+        self._queue.join()
+
+    def deliver(self, messages: list) -> list:
+        results = []
+        connection = get_connection(fail_silently=False)
+        try:
+            try:
+                connection.open()
+            except Exception:
+                # Sending opens the connection again, so every message still gets its retries
+                traceback.print_exc()
+            for label, message in messages:
+                message.connection = connection
+                error = None
+                for attempt in range(self._retries):
+                    try:
+                        message.send()
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        # The server may have dropped us, reconnect before trying again
+                        connection.close()
+                        if attempt + 1 < self._retries:
+                            time.sleep(self._retry_delay)
+                            try:
+                                connection.open()
+                            except Exception as e:
+                                error = e
+                results.append((label, error is None, error))
+        finally:
+            connection.close()
+        return results
+
+    def _run(self):
+        while True:
+            messages, on_complete, context = self._queue.get()
+            # The callbacks use the ORM: drop the connections the server closed or past CONN_MAX_AGE,
+            # as a request would, the thread lives as long as the process
+            close_old_connections()
+            try:
+                results = self.deliver(messages)
+                if on_complete is not None:
+                    context.run(on_complete, results)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                close_old_connections()
+                self._queue.task_done()
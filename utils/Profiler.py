@@ -0,0 +1,60 @@
+import collections
+import sys
+import threading
+import time
+
+
+class Profiler(object):
+    """Sampling profiler for the calling thread.
+
+    A background thread reads the stack of the profiled thread every ``interval`` seconds,
+    so the profiled code runs untouched. Stacks are counted in the folded format read by
+    flamegraph.pl and speedscope: one ``outer;inner;leaf count`` line per distinct stack.
+    """
+    _interval = None
+    _thread_id = None
+    _stop = None
+    _sampler = None
+    stacks = None
+    samples = 0
+    started = None
+    duration = None
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self.stacks = collections.Counter()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self.started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+
+    def folded(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
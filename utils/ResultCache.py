@@ -0,0 +1,51 @@
+import collections
+import threading
+import time
+
+
+class ResultCache(object):
+    """Bounded LRU cache whose entries expire ``ttl`` seconds after being stored.
+
+    Thread safe, counts hits and misses so the hit rate can be reported.
+    """
+    _maxsize = None
+    _ttl = None
+    _entries = None
+    _lock = None
+    hits = 0
+    misses = 0
+
+    def __init__(self, maxsize: int = 256, ttl: float = 120):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self._maxsize < 1:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self._maxsize}
@@ -0,0 +1,67 @@
+import threading
+
+import requests
+
+from utils.CircuitBreaker import CircuitBreaker
+
+
+class TelegramUnavailable(requests.RequestException):
+    """The circuit breaker is open, the Bot API was not called."""
+
+
+class TelegramClient(object):
+    _token = None
+    _base_url = None
+    _timeout = None
+    _breaker = None
+    # One breaker per endpoint, shared by the clients of every bot of the process
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, token, base_url="https://api.telegram.org/bot", timeout=(3.05, 10),
+                 breaker: CircuitBreaker = None):
+        self._token = token
+        self._base_url = base_url
+        # Seconds to connect and to wait for the reply
+        self._timeout = timeout
+        self._breaker = breaker or self.breakerFor(base_url)
+
+    @classmethod
+    def breakerFor(cls, base_url: str, failures: int = 5, reset_timeout: float = 30) -> CircuitBreaker:
+        with cls._breakers_lock:
+            if base_url not in cls._breakers:
+                cls._breakers[base_url] = CircuitBreaker(failures, reset_timeout)
+            return cls._breakers[base_url]
+
+    def post(self, method: str, data: dict, files: dict = None) -> requests.Response:
+        if not self._breaker.allow():
+            raise TelegramUnavailable(f'Bot API unavailable, {method} not sent')
+        try:
+            response = requests.post(
+                f'{self._base_url}{self._token}/{method}', data=data, files=files, timeout=self._timeout
+            )
+        except requests.RequestException:
+            self._breaker.recordFailure()
+            raise
+        if response.status_code >= 500:
+            self._breaker.recordFailure()
+        else:
+            self._breaker.recordSuccess()
+        return response
+
+    def sendMessage(self, text: str, chat_id, parse_mode: str = "MarkdownV2") -> requests.Response:
+        data = {
+            "chat_id": chat_id,
+            "text": text,
+        }
+        if parse_mode is not None:
+            data["parse_mode"] = parse_mode
+        return self.post("sendMessage", data)
+
+    def sendDocument(self, file_name: str, content: bytes, chat_id, caption: str = None) -> requests.Response:
+        data = {
+            "chat_id": chat_id,
+        }
+        if caption is not None:
+            data["caption"] = caption
+        return self.post("sendDocument", data, files={"document": (file_name, content)})
@@ -0,0 +1,171 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from logging.handlers import RotatingFileHandler
+
+import requests
+from django.db import connections
+
+# Trace being recorded in this context, None when the current work was not sampled
+_traccia = contextvars.ContextVar('traccia', default=None)
+
+
+class Tracer(object):
+    """Records timed spans of sampled work and exports each finished trace from a background thread.
+
+    Traces go to a rotating JSONL file, or to an OTLP/HTTP collector when an endpoint is set.
+    With a sample rate of zero ``trace`` and ``span`` only read a context variable.
+    """
+    _sample_rate = None
+    _endpoint = None
+    _logger = None
+    _queue = None
+    _worker = None
+    _lock = None
+
+    def __init__(self, sample_rate: float = 0, path: str = None, endpoint: str = None,
+                 max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        self._sample_rate = sample_rate
+        self._endpoint = endpoint
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        if path and not endpoint and sample_rate > 0:
+            self._logger = logging.getLogger(f'coca_bot.tracing.{os.path.basename(path)}')
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            if not self._logger.handlers:
+                self._logger.addHandler(RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups))
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **attributes):
+        """Samples a unit of work, recording its ORM queries and nested spans when it is picked."""
+        if self._sample_rate <= 0 or _traccia.get() is not None or random.random() >= self._sample_rate:
+            yield
+            return
+        traccia = {
+            'trace_id': os.urandom(16).hex(),
+            'spans': [],
+            'stack': [],
+            'counts': {},
+            'closed': False,
+        }
+        token = _traccia.set(traccia)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._query))
+                with self.span(name, **attributes):
+                    yield
+        finally:
+            traccia['closed'] = True
+            _traccia.reset(token)
+            self._export(traccia)
+
+    def span(self, name: str, **attributes):
+        traccia = _traccia.get()
+        if traccia is None or traccia['closed']:
+            return contextlib.nullcontext()
+        return self._span(traccia, name, attributes)
+
+    def annotate(self, **attributes):
+        """Adds attributes to the innermost open span of the current trace."""
+        traccia = _traccia.get()
+        if traccia is not None and traccia['stack']:
+            traccia['stack'][-1]['attributes'].update(attributes)
+
+    def join(self):
+        """Blocks until every finished trace has been exported."""
+        self._queue.join()
+
+    @contextlib.contextmanager
+    def _span(self, traccia: dict, name: str, attributes: dict):
+        span = {
+            'span_id': os.urandom(8).hex(),
+            'parent_id': traccia['stack'][-1]['span_id'] if traccia['stack'] else None,
+            'name': name,
+            'start': time.time_ns(),
+            'attributes': attributes,
+        }
+        inizio = time.perf_counter()
+        traccia['stack'].append(span)
+        try:
+            yield span
+        except Exception as e:
+            span['error'] = repr(e)
+            raise
+        finally:
+            durata = (time.perf_counter() - inizio) * 1000
+            traccia['stack'].pop()
+            span['end'] = span['start'] + int(durata * 1e6)
+            span['duration_ms'] = round(durata, 3)
+            traccia['spans'].append(span)
+            conteggio = traccia['counts'].setdefault(name, {'count': 0, 'ms': 0})
+            conteggio['count'] += 1
+            conteggio['ms'] = round(conteggio['ms'] + durata, 3)
+
+    def _query(self, execute, sql, params, many, context):
+        with self.span('db.query', alias=context['connection'].alias, sql=sql[:200]):
+            return execute(sql, params, many, context)
+
+    def _export(self, traccia: dict):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='tracer', daemon=True)
+                self._worker.start()
+        self._queue.put(traccia)
+
+    def _run(self):
+        while True:
+            traccia = self._queue.get()
+            try:
+                if self._endpoint:
+                    requests.post(self._endpoint, json=self.toOtlp(traccia), timeout=5)
+                elif self._logger is not None:
+                    self._logger.info(json.dumps(self.toJson(traccia)))
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def toJson(self, traccia: dict) -> dict:
+        radice = traccia['spans'][-1]
+        return {
+            'trace_id': traccia['trace_id'],
+            'name': radice['name'],
+            'start': radice['start'] / 1e9,
+            'duration_ms': radice['duration_ms'],
+            'counts': traccia['counts'],
+            'spans': [
+                {k: v for k, v in span.items() if k not in ('start', 'end')}
+                for span in traccia['spans']
+            ],
+        }
+
+    def toOtlp(self, traccia: dict) -> dict:
+        def attributi(valori: dict) -> list:
+            return [{'key': k, 'value': {'stringValue': str(v)}} for k, v in valori.items()]
+
+        return {'resourceSpans': [{
+            'resource': {'attributes': attributi({'service.name': 'coca_bot'})},
+            'scopeSpans': [{
+                'scope': {'name': 'coca_bot'},
+                'spans': [{
+                    'traceId': traccia['trace_id'],
+                    'spanId': span['span_id'],
+                    'parentSpanId': span['parent_id'] or '',
+                    'name': span['name'],
+                    'kind': 1,
+                    'startTimeUnixNano': str(span['start']),
+                    'endTimeUnixNano': str(span['end']),
+                    'attributes': attributi(span['attributes']),
+                    'status': {'code': 2, 'message': span['error']} if 'error' in span else {},
+                } for span in traccia['spans']],
+            }],
+        }]}